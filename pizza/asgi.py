@@ -9,8 +9,30 @@ https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from asgiref.sync import ThreadSensitiveContext
+from django.core.handlers import asgi
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pizza.settings')
 
-application = get_asgi_application()
+
+class ASGIHandler(asgi.ASGIHandler):
+
+    async def __call__(self, scope, receive, send):
+        match = ORDER_EVENTS_PATH.match(scope['path']) if scope['type'] == 'http' else None
+        if match:
+            await order_status_stream(scope, receive, send, int(match.group('order_id')))
+            return
+        # Django 3.0 runs the views with thread sensitive sync_to_async, which recent asgiref runs on a single thread
+        # for the whole process, so an ASGI server would serve one request at a time. Every request gets a thread
+        # of its own instead (what Django 3.2+ does), its database connection stays in that thread.
+        # ThreadSensitiveContext is in asgiref 3.3.2+, see requirements.txt.
+        async with ThreadSensitiveContext():
+            await super().__call__(scope, receive, send)
+
+
+django.setup(set_prefix=False)
+
+from pizzeria.order_stream import ORDER_EVENTS_PATH, order_status_stream  # noqa: E402
+
+application = ASGIHandler()
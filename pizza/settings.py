@@ -64,6 +64,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'pizzeria.middleware.CustomerCartMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.contrib.flatpages.middleware.FlatpageFallbackMiddleware'
@@ -82,6 +83,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'pizzeria.context_processors.idempotency_key',
             ],
         },
     },
@@ -105,6 +107,48 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    },
+    # Idempotency keys have to be seen by all the server processes, so a retry reaching another process isn't
+    # applied again. They are kept in the database (python manage.py createcachetable) unless another cache shared
+    # by the processes is set, never in locmem.
+    'idempotency': {
+        'BACKEND': os.getenv('IDEMPOTENCY_CACHE_BACKEND', 'django.core.cache.backends.db.DatabaseCache'),
+        'LOCATION': os.getenv('IDEMPOTENCY_CACHE_LOCATION', 'pizzeria_idempotency_cache'),
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
+}
+
+# How long a process using a cache of its own (locmem) keeps its menu version, with a cache shared by all
+# the processes the version is kept until the menu changes
+MENU_VERSION_LOCAL_TIMEOUT = 60
+
+# How long rendered pieces of the menu pages are kept, they are rendered again anyway when the menu changes
+FRAGMENT_CACHE_TIMEOUT = 60 * 60
+
+# Answer the menu filters from an in-process index, needs a cache shared by all the processes (not locmem)
+MENU_INDEX_ENABLED = os.getenv('MENU_INDEX_ENABLED', 'False') == 'True'
+
+# How long responses to cart changes and orders are replayed for retries with the same idempotency key,
+# how long a key stays locked while its first request is being processed and how long a double submitted page
+# waits for the first request's response
+IDEMPOTENCY_KEY_TTL = 60 * 60 * 24
+IDEMPOTENCY_PENDING_TTL = 60
+IDEMPOTENCY_WAIT_TIMEOUT = 5
+
+# Order status streams: the in-process broker reaches the streams of the same process only, with several server
+# processes use 'pizzeria.order_events.RedisBroker' (needs the redis package). Keepalive comment every N seconds.
+ORDER_EVENTS_BROKER = os.getenv('ORDER_EVENTS_BROKER', 'pizzeria.order_events.InProcessBroker')
+ORDER_EVENTS_REDIS_URL = os.getenv('ORDER_EVENTS_REDIS_URL', 'redis://localhost:6379/0')
+ORDER_EVENTS_HEARTBEAT = 15
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -148,6 +192,10 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Uploaded pizza/ingredient images are resized by a pool of background threads once the upload is saved
+IMAGE_PROCESSING_ASYNC = True
+IMAGE_PROCESSING_WORKERS = 2
+
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
 
 SITE_ID = 1
@@ -43,6 +43,18 @@ class OrderInline(admin.TabularInline):
         return False
 
 
+class OrderItemInline(admin.TabularInline):
+    model = OrderItem
+    extra = 0
+    readonly_fields = ['product', 'name', 'category', 'price', 'qty', 'final_price']
+
+    def has_add_permission(self, request, obj):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(Pizza)
 class PizzaAdmin(admin.ModelAdmin):
     readonly_fields = ['get_image']
@@ -71,6 +83,11 @@ class CategoryAdmin(admin.ModelAdmin):
     search_fields = ['pizza__name']
 
 
+@admin.register(Order)
+class OrderAdmin(admin.ModelAdmin):
+    inlines = [OrderItemInline]
+    readonly_fields = ['version']
+
+
 admin.site.register(Customer)
 admin.site.register(CartProduct)
-admin.site.register(Order)
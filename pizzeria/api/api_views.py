@@ -1,18 +1,33 @@
+import io
+import os
+
 from rest_framework import generics
+from rest_framework import status
 from rest_framework import viewsets
+from rest_framework.decorators import action
 from rest_framework.filters import SearchFilter, OrderingFilter
 from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
 
-from .serializers import CategorySerializer, PizzaSerializer, OrderSerializer, CartSerializer, CustomerSerializer
+from .conditions import menu_condition
+from .filters import MenuSearchFilter
+from .pagination import PageNumberOrCursorPagination, OrderHistoryPagination, KitchenQueuePagination
+from .serializers import (
+    CategorySerializer, PizzaSerializer, OrderSerializer, CartSerializer, CustomerSerializer, OrderHistorySerializer,
+    KitchenOrderSerializer, OrderStatusChangeSerializer
+)
+from ..kitchen import get_kitchen_queue, move_orders
+from ..menu_import import read_menu_rows, import_menu, MenuImportError
 from ..models import *
 
 
 class CategoryViewSet(viewsets.ModelViewSet):
     serializer_class = CategorySerializer
-    queryset = Category.objects.all()
+    queryset = Category.objects.prefetch_related('pizza_set')
     filter_backends = [SearchFilter, OrderingFilter]
     search_fields = ['name', 'slug']
+    ordering = ['id']
+    pagination_class = PageNumberOrCursorPagination
     lookup_field = 'slug'
 
     def get_permissions(self):
@@ -22,12 +37,22 @@ class CategoryViewSet(viewsets.ModelViewSet):
             self.permission_classes = [IsAdminUser]
         return super().get_permissions()
 
+    @menu_condition
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @menu_condition
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
 
 class PizzaViewSet(viewsets.ModelViewSet):
     serializer_class = PizzaSerializer
-    queryset = Pizza.objects.all()
-    filter_backends = [SearchFilter, OrderingFilter]
+    queryset = Pizza.objects.select_related('category').prefetch_related('ingredients')
+    filter_backends = [SearchFilter, OrderingFilter, MenuSearchFilter]
     search_fields = ['price', 'name', 'category__slug']
+    ordering = ['id']
+    pagination_class = PageNumberOrCursorPagination
     lookup_field = 'id'
 
     def get_permissions(self):
@@ -37,6 +62,14 @@ class PizzaViewSet(viewsets.ModelViewSet):
             self.permission_classes = [IsAdminUser]
         return super().get_permissions()
 
+    @menu_condition
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @menu_condition
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
     def create(self, request, *args, **kwargs):
         name = request.data['name']
         ingredients = Ingredient.objects.filter(name__in=request.data['ingredients'].split(', '))
@@ -52,6 +85,21 @@ class PizzaViewSet(viewsets.ModelViewSet):
         new_pizza.save()
         return Response({'response': 'Creation success'})
 
+    @action(detail=False, methods=['post'], url_path='import')
+    def bulk_import(self, request, *args, **kwargs):
+        menu_file = request.FILES.get('file')
+        if not menu_file:
+            return Response({'response': 'Send the menu as "file"'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            # Decoded while the rows are read, so a file which isn't UTF-8 is reported as an import error
+            rows = read_menu_rows(io.TextIOWrapper(menu_file.file, encoding='utf-8-sig', newline=''),
+                                  os.path.splitext(menu_file.name)[1].lstrip('.').lower())
+            pizzas = import_menu(rows, request.FILES.get)
+        except MenuImportError as e:
+            return Response({'response': 'Nothing was imported', 'errors': e.errors},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return Response({'response': f'Imported {len(pizzas)} pizzas'}, status=status.HTTP_201_CREATED)
+
 
 class OrderAPIView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = OrderSerializer
@@ -75,15 +123,50 @@ class OrderAPIView(generics.RetrieveUpdateDestroyAPIView):
         return self.destroy(request, *args, **kwargs)
 
 
+class OrderHistoryAPIView(generics.ListAPIView):
+    serializer_class = OrderHistorySerializer
+    pagination_class = OrderHistoryPagination
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return Order.objects.filter(customer__user=self.request.user).prefetch_related('items')
+
+
+class KitchenQueueAPIView(generics.ListAPIView):
+    serializer_class = KitchenOrderSerializer
+    pagination_class = KitchenQueuePagination
+    permission_classes = [IsAdminUser]
+
+    def get_queryset(self):
+        return get_kitchen_queue(self.request.query_params.get('status', Order.STATUS_NEW)).prefetch_related('items')
+
+
+class KitchenStatusAPIView(generics.GenericAPIView):
+    serializer_class = OrderStatusChangeSerializer
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        moved, conflicts = move_orders({order['id']: order['version'] for order in serializer.validated_data['orders']},
+                                       serializer.validated_data['status'])
+        # A conflicting order was changed by somebody else or deleted (null), the cook has to look at it again
+        return Response({
+            'moved': [{'id': pk, 'version': version} for pk, version in moved.items()],
+            'conflicts': [dict(id=pk, **(current or {'status': None, 'version': None}))
+                          for pk, current in conflicts.items()],
+        }, status=status.HTTP_409_CONFLICT if conflicts else status.HTTP_200_OK)
+
+
 class CartAPIView(generics.RetrieveAPIView):
     serializer_class = CartSerializer
-    queryset = Cart.objects.all()
+    queryset = Cart.objects.prefetch_related('related_products')
     permission_classes = [IsAuthenticated]
     lookup_field = 'id'
 
 
 class CustomerAPIView(generics.RetrieveAPIView):
     serializer_class = CustomerSerializer
-    queryset = Customer.objects.all()
+    queryset = Customer.objects.prefetch_related('orders')
     permission_classes = [IsAuthenticated]
     lookup_field = 'id'
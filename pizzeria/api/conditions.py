@@ -0,0 +1,21 @@
+import hashlib
+
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+
+from ..menu_version import get_menu_version
+
+
+def menu_etag(request, *args, **kwargs):
+    version, last_modified = get_menu_version()
+    key = f'{version}:{request.get_full_path()}:{request.META.get("HTTP_ACCEPT", "")}'
+    return hashlib.md5(key.encode()).hexdigest()
+
+
+def menu_last_modified(request, *args, **kwargs):
+    version, last_modified = get_menu_version()
+    return last_modified
+
+
+# Answers 304 Not Modified to unchanged menu polls before the queryset and the serializer are touched
+menu_condition = method_decorator(condition(etag_func=menu_etag, last_modified_func=menu_last_modified))
@@ -0,0 +1,13 @@
+from rest_framework.filters import BaseFilterBackend
+
+from ..search import search_pizzas
+
+
+class MenuSearchFilter(BaseFilterBackend):
+    # '?q=' searches the menu with the full-text index and orders the pizzas by relevance, so it goes after
+    # the ordering filter
+    search_param = 'q'
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param)
+        return search_pizzas(queryset, query) if query else queryset
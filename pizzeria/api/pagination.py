@@ -0,0 +1,49 @@
+from rest_framework.pagination import BasePagination, PageNumberPagination, CursorPagination
+
+
+class IdCursorPagination(CursorPagination):
+    ordering = 'id'
+
+
+class OrderHistoryPagination(CursorPagination):
+    # Ties broken by id, as in order_customer_created_idx, so cursor pages don't repeat or skip orders
+    ordering = ('-created_at', '-id')
+
+
+class KitchenQueuePagination(CursorPagination):
+    # Many orders are for the same time, ties are broken by id as in get_kitchen_queue
+    ordering = ('order_date_time', 'id')
+
+
+class PageNumberOrCursorPagination(BasePagination):
+    # Page numbers by default, '?pagination=cursor' switches to keyset pages without COUNT and OFFSET,
+    # the next/previous links then carry the 'cursor' parameter
+    mode_query_param = 'pagination'
+    cursor_mode = 'cursor'
+
+    def __init__(self):
+        self.page_number_paginator = PageNumberPagination()
+        self.cursor_paginator = IdCursorPagination()
+        self.paginator = self.page_number_paginator
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if request.query_params.get(self.mode_query_param) == self.cursor_mode or \
+                self.cursor_paginator.cursor_query_param in request.query_params:
+            self.paginator = self.cursor_paginator
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def to_html(self):
+        return self.paginator.to_html()
+
+    def get_results(self, data):
+        return self.paginator.get_results(data)
+
+    def get_schema_fields(self, view):
+        return self.page_number_paginator.get_schema_fields(view) + self.cursor_paginator.get_schema_fields(view)
+
+    def get_schema_operation_parameters(self, view):
+        return self.page_number_paginator.get_schema_operation_parameters(view) + \
+            self.cursor_paginator.get_schema_operation_parameters(view)
@@ -33,7 +33,7 @@ class CartProductSerializer(serializers.ModelSerializer):
 
 
 class CartSerializer(serializers.ModelSerializer):
-    products = CartProductSerializer(many=True)
+    products = CartProductSerializer(many=True, source='related_products')
 
     class Meta:
         model = Cart
@@ -44,6 +44,46 @@ class OrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = '__all__'
+        read_only_fields = ['version']
+
+
+class OrderItemSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = OrderItem
+        exclude = ['order']
+
+
+class OrderHistorySerializer(serializers.ModelSerializer):
+    items = OrderItemSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Order
+        exclude = ['cart']
+
+
+class KitchenOrderItemSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = OrderItem
+        fields = ['name', 'qty']
+
+
+class KitchenOrderSerializer(serializers.ModelSerializer):
+    items = KitchenOrderItemSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Order
+        fields = ['id', 'status', 'version', 'order_date_time', 'delivery', 'address', 'comment', 'items']
+
+
+class OrderVersionSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    version = serializers.IntegerField(min_value=0)
+
+
+class OrderStatusChangeSerializer(serializers.Serializer):
+    status = serializers.ChoiceField(choices=list(Order.STATUS_TRANSITIONS))
+    # A single UPDATE moves all of them, its WHERE grows with every order
+    orders = serializers.ListField(child=OrderVersionSerializer(), allow_empty=False, max_length=100)
 
 
 class CustomerSerializer(serializers.ModelSerializer):
@@ -1,7 +1,10 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
-from .api_views import OrderAPIView, CustomerAPIView, CartAPIView, PizzaViewSet, CategoryViewSet
+from .api_views import (
+    OrderAPIView, OrderHistoryAPIView, CustomerAPIView, CartAPIView, PizzaViewSet, CategoryViewSet, KitchenQueueAPIView,
+    KitchenStatusAPIView
+)
 
 router = DefaultRouter()
 router.register('categories', CategoryViewSet, basename='categories')
@@ -9,6 +12,9 @@ router.register('pizzas', PizzaViewSet, basename='pizzas')
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('orders/', OrderHistoryAPIView.as_view()),
+    path('kitchen/orders/', KitchenQueueAPIView.as_view()),
+    path('kitchen/orders/status/', KitchenStatusAPIView.as_view()),
     path('order/<str:id>/', OrderAPIView.as_view()),
     path('customer/<str:id>/', CustomerAPIView.as_view()),
     path('cart/<str:id>/', CartAPIView.as_view())
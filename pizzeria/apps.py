@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class PizzeriaConfig(AppConfig):
     name = 'pizzeria'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,33 @@
+from django.db import transaction
+
+from .models import Cart, CartProduct, OrderItem
+
+
+class CheckoutError(Exception):
+    pass
+
+
+@transaction.atomic
+def place_order(customer, cart, order):
+    # The cart row stays locked until the order is committed, so a double submit finds it already ordered
+    cart = Cart.objects.select_for_update().filter(pk=cart.pk if cart else None, in_order=False).first()
+    if not cart:
+        raise CheckoutError('This cart has already been ordered')
+    # The totals are counted from the products being ordered, not taken from the cart's stored counters
+    cart_products = list(CartProduct.objects.get_cart_products(cart))
+    if not cart_products:
+        raise CheckoutError('Your cart is empty')
+    order.customer = customer
+    order.cart = cart
+    order.total_products = sum(cart_product.qty for cart_product in cart_products)
+    order.final_price = sum(cart_product.final_price for cart_product in cart_products)
+    order.save()
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, product=cart_product.product, name=cart_product.product.name,
+                  category=cart_product.product.category.name, price=cart_product.product.price,
+                  qty=cart_product.qty, final_price=cart_product.final_price)
+        for cart_product in cart_products
+    ])
+    Cart.objects.filter(pk=cart.pk).update(in_order=True)
+    customer.orders.add(order)
+    return order
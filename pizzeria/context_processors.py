@@ -0,0 +1,5 @@
+from .idempotency import new_idempotency_key
+
+
+def idempotency_key(request):
+    return {'idempotency_key': new_idempotency_key()}
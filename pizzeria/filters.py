@@ -1,29 +1,82 @@
 import django_filters
-from django.db.models import Count
+from django import forms
+from django.db.models import Count, Exists, OuterRef
 
+from .menu_index import menu_index
 from .models import Pizza, Ingredient
+from .search import search_pizzas
 
 
 class PizzaFilter(django_filters.FilterSet):
+    MATCH_ALL = 'all'
+    MATCH_ANY = 'any'
+
+    MATCH_CHOICES = (
+        (MATCH_ALL, 'All of the chosen ingredients'),
+        (MATCH_ANY, 'Any of the chosen ingredients')
+    )
+
     price__gt = django_filters.NumberFilter(field_name='price', lookup_expr='gt')
     price__lt = django_filters.NumberFilter(field_name='price', lookup_expr='lt')
-    description_cont = django_filters.CharFilter(field_name='description', lookup_expr='icontains')
+    q = django_filters.CharFilter(label='Search', method='filter_search')
+    # Deprecated, the old description search kept for bookmarked links, searches like q
+    description_cont = django_filters.CharFilter(method='filter_search', widget=forms.HiddenInput)
     ingredients = django_filters.ModelMultipleChoiceFilter(field_name='ingredients',
                                                            queryset=Ingredient.objects.all(),
                                                            method='filter_ingredients')
+    ingredients_match = django_filters.ChoiceFilter(choices=MATCH_CHOICES, empty_label=None,
+                                                    label='Pizza contains', method='filter_ingredients_match')
 
     class Meta:
         model = Pizza
-        fields = ['price__gt', 'price__lt', 'ingredients', 'category', 'description_cont']
+        fields = ['q', 'description_cont', 'price__gt', 'price__lt', 'ingredients', 'ingredients_match', 'category']
 
-    @staticmethod
-    def filter_ingredients(queryset, name, value):
+    def filter_ingredients(self, queryset, name, value):
         if name and value:
-            value_len = len(value)
-            return queryset.filter(id__in=[
-                pizza['id'] for pizza in queryset.filter(
-                    ingredients__in=value
-                ).values('id').annotate(count=Count('id')) if pizza['count'] == value_len
-            ])
+            if self.form.cleaned_data.get('ingredients_match') == self.MATCH_ANY:
+                return queryset.filter(Exists(Pizza.ingredients.through.objects.filter(
+                    pizza=OuterRef('pk'), ingredient__in=value
+                )))
+            return queryset.filter(ingredients__in=value).annotate(
+                matched_ingredients=Count('ingredients')
+            ).filter(matched_ingredients=len(value))
         else:
             return queryset
+
+    @staticmethod
+    def filter_search(queryset, name, value):
+        return search_pizzas(queryset, value)
+
+    @staticmethod
+    def filter_ingredients_match(queryset, name, value):
+        # Only changes how filter_ingredients matches the chosen ingredients
+        return queryset
+
+
+class IndexedPizzaFilter(PizzaFilter):
+    # Answers ingredients filtering (with price and category) from the in-process menu index instead of joining
+    # the ingredients table, without chosen ingredients the database is faster with its own indexes
+    index_filters = ['price__gt', 'price__lt', 'ingredients', 'ingredients_match', 'category']
+    # More matching pizzas than this would be sent back to the database as a long IN list, the database matches
+    # them itself faster then
+    max_index_ids = 500
+
+    def filter_queryset(self, queryset):
+        data = self.form.cleaned_data
+        ingredient_ids = [ingredient.pk for ingredient in data.get('ingredients') or []]
+        if not ingredient_ids:
+            return super().filter_queryset(queryset)
+        pizza_ids = menu_index.filter_ids(
+            ingredient_ids=ingredient_ids,
+            match_any=data.get('ingredients_match') == self.MATCH_ANY,
+            price_gt=data.get('price__gt'),
+            price_lt=data.get('price__lt'),
+            category_id=data['category'].pk if data.get('category') else None
+        )
+        if len(pizza_ids) > self.max_index_ids:
+            return super().filter_queryset(queryset)
+        queryset = queryset.filter(pk__in=pizza_ids)
+        for name, value in data.items():
+            if name not in self.index_filters:
+                queryset = self.filters[name].filter(queryset, value)
+        return queryset
@@ -0,0 +1,55 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .menu_version import get_menu_version
+
+FRAGMENT_CACHE_HITS_KEY = 'pizzeria:fragment_cache_hits'
+FRAGMENT_CACHE_MISSES_KEY = 'pizzeria:fragment_cache_misses'
+# Per-request values used inside the cached fragments, they are cached as placeholders and filled in on every render
+FRAGMENT_PLACEHOLDERS = ['idempotency_key']
+
+
+def get_fragment_cache_key(name, vary_on):
+    # Fragments are cached per menu version, so any change to the menu renders them again
+    version, last_modified = get_menu_version()
+    vary_on_hash = hashlib.md5(':'.join(vary_on).encode()).hexdigest()
+    return f'pizzeria:fragment:{name}:{version}:{vary_on_hash}'
+
+
+def get_placeholder(name):
+    return f'__fragment_placeholder_{name}__'
+
+
+def render_cached_fragment(name, vary_on, context, render):
+    key = get_fragment_cache_key(name, vary_on)
+    content = cache.get(key)
+    if content is None:
+        count_fragment_cache(FRAGMENT_CACHE_MISSES_KEY)
+        with context.push({placeholder: get_placeholder(placeholder) for placeholder in FRAGMENT_PLACEHOLDERS}):
+            content = render(context)
+        cache.set(key, content, settings.FRAGMENT_CACHE_TIMEOUT)
+    else:
+        count_fragment_cache(FRAGMENT_CACHE_HITS_KEY)
+    for placeholder in FRAGMENT_PLACEHOLDERS:
+        content = content.replace(get_placeholder(placeholder), str(context.get(placeholder, '')))
+    return content
+
+
+def count_fragment_cache(key):
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted between add and incr
+        pass
+
+
+def get_fragment_cache_stats():
+    stats = cache.get_many([FRAGMENT_CACHE_HITS_KEY, FRAGMENT_CACHE_MISSES_KEY])
+    return stats.get(FRAGMENT_CACHE_HITS_KEY, 0), stats.get(FRAGMENT_CACHE_MISSES_KEY, 0)
+
+
+def reset_fragment_cache_stats():
+    cache.delete_many([FRAGMENT_CACHE_HITS_KEY, FRAGMENT_CACHE_MISSES_KEY])
@@ -0,0 +1,79 @@
+import hashlib
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseRedirect
+
+IDEMPOTENCY_KEY_HEADER = 'HTTP_IDEMPOTENCY_KEY'
+IDEMPOTENCY_KEY_FIELD = 'idempotency_key'
+IDEMPOTENCY_PENDING = 'pending'
+IDEMPOTENCY_CACHE = 'idempotency'
+
+
+def new_idempotency_key():
+    return uuid.uuid4().hex
+
+
+def get_idempotency_key(request):
+    # An Idempotency-Key header for API clients, an idempotency_key form field or query parameter for pages
+    return (request.META.get(IDEMPOTENCY_KEY_HEADER) or request.POST.get(IDEMPOTENCY_KEY_FIELD)
+            or request.GET.get(IDEMPOTENCY_KEY_FIELD))
+
+
+def get_idempotency_cache_key(request, key):
+    # Keys are scoped to the user and the url, so one key can be shared by all the links of a rendered page
+    scope = f'{request.user.pk}:{request.path}:{key}'
+    return f'pizzeria:idempotency_request:{hashlib.md5(scope.encode()).hexdigest()}'
+
+
+def get_request_fingerprint(request):
+    # A key sent again with other parameters (e.g. another qty) isn't a retry of the same request
+    params = sorted(
+        (name, value) for query in (request.GET, request.POST) for name, values in query.lists() for value in values
+        if name not in (IDEMPOTENCY_KEY_FIELD, 'csrfmiddlewaretoken')
+    )
+    return hashlib.md5(f'{request.method}:{params}'.encode()).hexdigest()
+
+
+def claim_idempotency_key(cache_key, fingerprint):
+    # Returns None if the request is the first one with this key, otherwise what the first one stored:
+    # (fingerprint, None) while it's being processed, (fingerprint, (status code, location)) when it's done
+    pending = (fingerprint, None)
+    if caches[IDEMPOTENCY_CACHE].add(cache_key, pending, settings.IDEMPOTENCY_PENDING_TTL):
+        return None
+    return caches[IDEMPOTENCY_CACHE].get(cache_key, pending)
+
+
+def wait_for_response(cache_key, timeout):
+    # Returns what the first request stored once it's done, or the last value seen when the time is up
+    deadline = time.monotonic() + timeout
+    while True:
+        stored = caches[IDEMPOTENCY_CACHE].get(cache_key)
+        if stored is None or stored[1] is not None or time.monotonic() >= deadline:
+            return stored
+        time.sleep(0.05)
+
+
+def store_redirect(cache_key, fingerprint, response):
+    caches[IDEMPOTENCY_CACHE].set(
+        cache_key, (fingerprint, (response.status_code, response['Location'])), settings.IDEMPOTENCY_KEY_TTL
+    )
+
+
+def release_idempotency_key(cache_key):
+    caches[IDEMPOTENCY_CACHE].delete(cache_key)
+
+
+def replay_response(stored, fingerprint, pending_url=None):
+    # pending_url is where pages are sent while the first request is still being processed
+    stored_fingerprint, response = stored
+    if stored_fingerprint != fingerprint:
+        return HttpResponse('This idempotency key was used for a different request', status=422)
+    if response is None:
+        if pending_url:
+            return HttpResponseRedirect(pending_url)
+        return HttpResponse('A request with this idempotency key is still being processed', status=409)
+    status_code, location = response
+    return HttpResponseRedirect(location, status=status_code)
@@ -0,0 +1,43 @@
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import F, Q
+
+from .models import Order
+from .order_events import publish_order_status
+
+KITCHEN_STATUSES = [Order.STATUS_NEW, Order.STATUS_IN_PROGRESS, Order.STATUS_READY]
+
+
+class KitchenError(Exception):
+    pass
+
+
+def get_kitchen_queue(status):
+    # Served by order_status_date_time_idx without sorting, orders for the same time in the order they came in
+    return Order.objects.filter(status=status).order_by('order_date_time', 'id')
+
+
+@transaction.atomic
+def move_orders(versions, status):
+    # versions maps order ids to the versions the cook has seen. All the orders are moved with one UPDATE, an order
+    # changed by somebody else since then (its version is different) or not in the previous status is left as it is.
+    # Returns the new versions of the moved orders and the current status and version (None if deleted) of the others.
+    if status not in Order.STATUS_TRANSITIONS:
+        raise KitchenError(f'Orders can\'t be moved to "{status}"')
+    if not versions:
+        return {}, {}
+    seen = reduce(or_, (Q(pk=pk, version=version) for pk, version in versions.items()))
+    # The matching rows stay locked until the UPDATE is committed, so these are exactly the orders it moves
+    moved = list(Order.objects.select_for_update().filter(seen, status=Order.STATUS_TRANSITIONS[status]).values_list(
+        'pk', flat=True
+    ))
+    Order.objects.filter(pk__in=moved).update(status=status, version=F('version') + 1)
+    conflicts = {pk: None for pk in versions if pk not in moved}
+    for pk, current_status, version in Order.objects.filter(pk__in=conflicts).values_list('pk', 'status', 'version'):
+        conflicts[pk] = {'status': current_status, 'version': version}
+    # update() doesn't send post_save
+    for pk in moved:
+        publish_order_status(pk, status)
+    return {pk: versions[pk] + 1 for pk in moved}, conflicts
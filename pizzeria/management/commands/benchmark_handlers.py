@@ -0,0 +1,125 @@
+import asyncio
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY, BACKEND_SESSION_KEY, HASH_SESSION_KEY, get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.handlers import asgi
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.authtoken.models import Token
+
+from pizza.asgi import ASGIHandler
+
+
+class Command(BaseCommand):
+    help = 'Sends the same load of GET requests to the WSGI handler (a thread per connection, like a threaded WSGI ' \
+           'server) and to the ASGI handlers (concurrent requests in an event loop) and compares their throughput'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*', default=['/', '/api/pizzas/'])
+        parser.add_argument('--user', required=True, help='Username the requests are sent by')
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--host', default='localhost')
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(username=options['user'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f'There is no user "{options["user"]}"')
+        session = SessionStore()
+        session.update({SESSION_KEY: str(user.pk), BACKEND_SESSION_KEY: settings.AUTHENTICATION_BACKENDS[0],
+                        HASH_SESSION_KEY: user.get_session_auth_hash()})
+        session.create()
+        token, _ = Token.objects.get_or_create(user=user)
+        headers = {
+            'host': options['host'],
+            'cookie': f'{settings.SESSION_COOKIE_NAME}={session.session_key}',
+            'authorization': f'Token {token.key}',
+        }
+        paths = options['paths']
+        requests = [paths[i % len(paths)] for i in range(options['requests'])]
+        concurrency = options['concurrency']
+        try:
+            self.report(f'WSGI, {concurrency} threads', self.run_wsgi(requests, headers, concurrency))
+            self.report('ASGI, Django handler', self.run_asgi(asgi.ASGIHandler(), requests, headers, concurrency))
+            self.report('ASGI, pizza.asgi handler', self.run_asgi(ASGIHandler(), requests, headers, concurrency))
+        finally:
+            session.delete()
+
+    def report(self, name, result):
+        elapsed, results = result
+        latencies = sorted(latency for status, latency in results)
+        errors = sum(1 for status, latency in results if status >= 400)
+        self.stdout.write(
+            f'{name}: {len(results) / elapsed:.1f} requests/s, '
+            f'p50 {self.percentile(latencies, 50):.1f} ms, p95 {self.percentile(latencies, 95):.1f} ms'
+            + (f', {errors} errors' if errors else '')
+        )
+
+    @staticmethod
+    def percentile(latencies, percent):
+        return latencies[min(len(latencies) - 1, len(latencies) * percent // 100)] * 1000
+
+    @staticmethod
+    def split_path(path):
+        path, _, query_string = path.partition('?')
+        return path, query_string
+
+    def run_wsgi(self, requests, headers, concurrency):
+        handler = WSGIHandler()
+
+        def send(path):
+            path, query_string = self.split_path(path)
+            environ = {
+                'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query_string, 'SCRIPT_NAME': '',
+                'SERVER_NAME': headers['host'], 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+                'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': BytesIO(),
+                'wsgi.errors': sys.stderr, 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+                'wsgi.run_once': False,
+                **{f'HTTP_{name.upper()}': value for name, value in headers.items()},
+            }
+            status = []
+            started_at = time.perf_counter()
+            response = handler(environ, lambda response_status, response_headers: status.append(response_status))
+            b''.join(response)
+            response.close()
+            return int(status[0].split()[0]), time.perf_counter() - started_at
+
+        started_at = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            results = list(executor.map(send, requests))
+        return time.perf_counter() - started_at, results
+
+    def run_asgi(self, handler, requests, headers, concurrency):
+
+        async def send(path, semaphore):
+            path, query_string = self.split_path(path)
+            scope = {
+                'type': 'http', 'method': 'GET', 'path': path, 'query_string': query_string.encode(),
+                'headers': [(name.encode(), value.encode()) for name, value in headers.items()],
+            }
+            messages = []
+
+            async def receive():
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+            async def send_message(message):
+                messages.append(message)
+
+            async with semaphore:
+                started_at = time.perf_counter()
+                await handler(scope, receive, send_message)
+                return messages[0]['status'], time.perf_counter() - started_at
+
+        async def run():
+            semaphore = asyncio.Semaphore(concurrency)
+            return await asyncio.gather(*(send(path, semaphore) for path in requests))
+
+        started_at = time.perf_counter()
+        results = asyncio.run(run())
+        return time.perf_counter() - started_at, results
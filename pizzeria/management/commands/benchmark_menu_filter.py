@@ -0,0 +1,94 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from pizzeria.filters import PizzaFilter, IndexedPizzaFilter
+from pizzeria.menu_index import menu_index
+from pizzeria.models import Pizza, Ingredient, Category
+
+
+class Command(BaseCommand):
+    help = 'Compares the menu filtering through the database with the in-process menu index on a synthetic ' \
+           'catalog, which is rolled back afterwards'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pizzas', type=int, default=50000)
+        parser.add_argument('--ingredients', type=int, default=60)
+        parser.add_argument('--categories', type=int, default=10)
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        try:
+            with transaction.atomic():
+                ingredients, categories = self.create_catalog(options['pizzas'], options['ingredients'],
+                                                              options['categories'])
+                started_at = time.perf_counter()
+                menu_index.filter_ids()
+                self.stdout.write(f'Menu index built in {(time.perf_counter() - started_at) * 1000:.1f} ms')
+                for name, data in self.get_queries(ingredients, categories):
+                    self.benchmark(name, data, options['repeat'])
+                transaction.set_rollback(True)
+        finally:
+            menu_index.invalidate()
+
+    def create_catalog(self, pizzas_count, ingredients_count, categories_count):
+        categories = self.bulk_create(Category, (
+            Category(name=f'Benchmark category {i}', slug=f'benchmark-category-{i}') for i in range(categories_count)
+        ))
+        ingredients = self.bulk_create(Ingredient, (
+            Ingredient(name=f'Benchmark ingredient {i}') for i in range(ingredients_count)
+        ))
+        pizzas = self.bulk_create(Pizza, (
+            Pizza(name=f'Benchmark pizza {i}', slug=f'benchmark-pizza-{i}', category=random.choice(categories),
+                  price=Decimal(random.randint(500, 3000)) / 100, image='benchmark.jpg', description='Benchmark',
+                  in_stock=random.random() < 0.9)
+            for i in range(pizzas_count)
+        ))
+        Pizza.ingredients.through.objects.bulk_create((
+            Pizza.ingredients.through(pizza_id=pizza.pk, ingredient_id=ingredient.pk)
+            for pizza in pizzas for ingredient in random.sample(ingredients, random.randint(3, 8))
+        ), batch_size=500)
+        menu_index.invalidate()
+        self.stdout.write(f'Created {pizzas_count} pizzas, {ingredients_count} ingredients, '
+                          f'{categories_count} categories')
+        return ingredients, categories
+
+    @staticmethod
+    def bulk_create(model, objects):
+        objects = model.objects.bulk_create(objects, batch_size=500)
+        if objects and objects[0].pk is None:
+            # Databases which don't return ids from bulk inserts
+            objects = list(model.objects.filter(name__startswith='Benchmark ').order_by('pk'))
+        return objects
+
+    @staticmethod
+    def get_queries(ingredients, categories):
+        first, second, third = (ingredient.pk for ingredient in random.sample(ingredients, 3))
+        return [
+            ('2 ingredients (all)', {'ingredients': [first, second]}),
+            ('3 ingredients (all)', {'ingredients': [first, second, third]}),
+            ('2 ingredients (any) and price', {'ingredients': [first, second], 'ingredients_match': 'any',
+                                              'price__gt': '10', 'price__lt': '15'}),
+            ('Ingredient and category', {'ingredients': [first], 'category': categories[0].pk}),
+            ('Category and price', {'category': categories[0].pk, 'price__lt': '12'}),
+        ]
+
+    def benchmark(self, name, data, repeat):
+        results = {}
+        for label, filter_class in (('database', PizzaFilter), ('menu index', IndexedPizzaFilter)):
+            started_at = time.perf_counter()
+            for _ in range(repeat):
+                pizza_ids = list(filter_class(data, queryset=Pizza.objects.filter(in_stock=True)).qs.values_list(
+                    'pk', flat=True
+                ))
+            results[label] = ((time.perf_counter() - started_at) * 1000 / repeat, len(pizza_ids))
+        (database_time, database_count), (index_time, index_count) = results.values()
+        if database_count != index_count:
+            self.stderr.write(f'{name}: the database found {database_count} pizzas, the index {index_count}')
+        self.stdout.write(f'{name}: {database_count} pizzas, database {database_time:.1f} ms, '
+                          f'menu index {index_time:.1f} ms ({database_time / index_time:.1f}x)')
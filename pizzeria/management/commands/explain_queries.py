@@ -0,0 +1,70 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from pizzeria.kitchen import get_kitchen_queue
+from pizzeria.models import Pizza, Cart, CartProduct, Order
+
+# Plan lines which mean that a query reads a whole table or sorts rows itself instead of using an index
+PLAN_REGRESSIONS = {
+    'sqlite': [r'\bSCAN (?:TABLE )?\w+\b(?! USING (?:COVERING )?INDEX)', r'USE TEMP B-TREE'],
+    'postgresql': [r'Seq Scan on \w+', r'Sort Key:'],
+}
+PLAN_INDEXES = {
+    'sqlite': r'USING (?:COVERING )?INDEX (\w+)',
+    'postgresql': r'(?:Index (?:Only )?Scan (?:Backward )?using|Bitmap Index Scan on) (\w+)',
+}
+
+
+def get_plan_regressions(plan, vendor):
+    return [match.group(0) for pattern in PLAN_REGRESSIONS.get(vendor, []) for match in re.finditer(pattern, plan)]
+
+
+def get_plan_indexes(plan, vendor):
+    return re.findall(PLAN_INDEXES[vendor], plan) if vendor in PLAN_INDEXES else []
+
+
+class Command(BaseCommand):
+    help = 'Runs EXPLAIN on the hot queries and fails if any of them reads a whole table or sorts without an index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--plans', action='store_true', help='Print the whole plan of every query')
+
+    def get_queries(self):
+        # The planner doesn't need the ids to exist, any value gives the plan of the real query
+        return [
+            ('open cart', Cart.objects.select_related('customer').filter(customer__user=1, in_order=False)),
+            ('category pizzas', Pizza.objects.filter(category=1, in_stock=True)),
+            ('menu price range', Pizza.objects.filter(in_stock=True, price__gt=10, price__lt=20)),
+            ('cart products', CartProduct.objects.get_cart_products(1)),
+            ('cart product', CartProduct.objects.filter(cart=1, product=1)),
+            ('order history', Order.objects.filter(customer=1).order_by('-created_at', '-id')),
+            ('orders by status', Order.objects.filter(customer=1, status=Order.STATUS_NEW)),
+            ('kitchen queue', get_kitchen_queue(Order.STATUS_NEW)),
+        ]
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        if vendor not in PLAN_REGRESSIONS:
+            self.stdout.write(self.style.WARNING(f'Plans of {vendor} are not checked, only printed'))
+        regressions = []
+        with transaction.atomic():
+            if vendor == 'postgresql':
+                # Small tables are read sequentially anyway, what matters is whether an index can serve the query
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            for name, queryset in self.get_queries():
+                plan = queryset.explain()
+                problems = get_plan_regressions(plan, vendor)
+                indexes = ', '.join(get_plan_indexes(plan, vendor)) or 'no index'
+                if problems:
+                    regressions.append(name)
+                    self.stdout.write(self.style.ERROR(f'{name}: {"; ".join(problems)} ({indexes})'))
+                else:
+                    self.stdout.write(f'{name}: {indexes}')
+                if options['plans'] or problems or vendor not in PLAN_REGRESSIONS:
+                    self.stdout.write(plan)
+        if regressions:
+            raise CommandError(f'Queries not served by indexes: {", ".join(regressions)}')
+        self.stdout.write(self.style.SUCCESS('All hot queries use indexes'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from pizzeria.fragment_cache import get_fragment_cache_stats, reset_fragment_cache_stats
+
+
+class Command(BaseCommand):
+    help = 'Shows how many menu page fragments were served from the cache and how many were rendered'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Start counting from zero')
+
+    def handle(self, *args, **options):
+        hits, misses = get_fragment_cache_stats()
+        total = hits + misses
+        hit_rate = f'{hits / total:.1%}' if total else 'n/a'
+        self.stdout.write(f'Hits: {hits}, misses: {misses}, hit rate: {hit_rate}')
+        if options['reset']:
+            reset_fragment_cache_stats()
+            self.stdout.write(self.style.SUCCESS('Counters reset'))
@@ -0,0 +1,37 @@
+import os
+from contextlib import ExitStack
+
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+
+from pizzeria.menu_import import read_menu_rows, import_menu, MenuImportError
+
+
+class Command(BaseCommand):
+    help = 'Imports pizzas from a CSV or JSON lines file, their images are read from --images-dir'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSON lines file with name, slug, price, category, ingredients, '
+                                         'description, in_stock and image of each pizza')
+        parser.add_argument('--images-dir', help='Directory with the images, the menu file\'s directory by default')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Guessed from the file extension by default')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        images_dir = options['images_dir'] or os.path.dirname(os.path.abspath(path))
+        file_format = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+
+        with ExitStack() as stack:
+            def open_image(name):
+                image_path = os.path.join(images_dir, name)
+                if not os.path.isfile(image_path):
+                    return None
+                return File(stack.enter_context(open(image_path, 'rb')), name=os.path.basename(name))
+
+            try:
+                with open(path, encoding='utf-8-sig', newline='') as menu_file:
+                    rows = read_menu_rows(menu_file, file_format)
+                pizzas = import_menu(rows, open_image)
+            except MenuImportError as e:
+                raise CommandError(f'Nothing was imported:\n{e}')
+        self.stdout.write(self.style.SUCCESS(f'Imported {len(pizzas)} pizzas, their images are being processed'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from pizzeria.models import Cart
+
+
+class Command(BaseCommand):
+    help = 'Checks that carts\' total_products and final_price match their products and fixes the ones that don\'t'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report carts with wrong totals')
+
+    def handle(self, *args, **options):
+        cart_ids = list(Cart.objects.get_carts_with_wrong_totals().values_list('pk', flat=True))
+        if not cart_ids:
+            self.stdout.write(self.style.SUCCESS('All cart totals are consistent'))
+            return
+        self.stdout.write(self.style.WARNING(f'Carts with wrong totals: {", ".join(map(str, cart_ids))}'))
+        if not options['dry_run']:
+            Cart.objects.reconcile_totals(cart_ids)
+            self.stdout.write(self.style.SUCCESS(f'Reconciled {len(cart_ids)} cart(s)'))
@@ -1,5 +1,11 @@
-from django.db import models
-from django.db.models import Q, Count
+import sqlite3
+
+from django.core.cache import cache
+from django.db import models, connections, transaction, IntegrityError
+from django.db.models import Q, Count, F, Sum, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+SIDEBAR_CACHE_KEY = 'pizzeria:sidebar_categories'
 
 
 class CategoryManager(models.Manager):
@@ -8,4 +14,89 @@ class CategoryManager(models.Manager):
         return super().get_queryset()
 
     def get_categories_for_sidebar(self):
-        return self.get_queryset().annotate(count=Count('pizza'))
+        # The menu changes rarely, so the counts are cached until a pizza or a category changes
+        # (or the cache's default timeout passes, for processes which didn't see the change with a local cache)
+        categories = cache.get(SIDEBAR_CACHE_KEY)
+        if categories is None:
+            categories = list(self.get_queryset().annotate(count=Count('pizza', filter=Q(pizza__in_stock=True))))
+            cache.set(SIDEBAR_CACHE_KEY, categories)
+        return categories
+
+    @staticmethod
+    def clear_sidebar_cache():
+        cache.delete(SIDEBAR_CACHE_KEY)
+
+
+class CartManager(models.Manager):
+
+    def apply_totals_delta(self, cart_id, qty, price):
+        return self.get_queryset().filter(pk=cart_id).update(
+            total_products=Coalesce(F('total_products'), 0) + qty,
+            final_price=Coalesce(F('final_price'), 0) + price
+        )
+
+    def get_carts_with_wrong_totals(self):
+        return self.get_queryset().annotate(
+            stored_products=Coalesce('total_products', 0),
+            stored_price=Coalesce('final_price', 0),
+            actual_products=Coalesce(Sum('related_products__qty'), 0),
+            actual_price=Coalesce(Sum('related_products__final_price'), 0)
+        ).exclude(stored_products=F('actual_products'), stored_price=F('actual_price'))
+
+    def reconcile_totals(self, cart_ids):
+        cart_products = self.model._meta.get_field('related_products').related_model.objects.filter(
+            cart=OuterRef('pk')
+        ).order_by().values('cart')
+        return self.get_queryset().filter(pk__in=cart_ids).update(
+            total_products=Coalesce(Subquery(cart_products.annotate(total=Sum('qty')).values('total')), 0),
+            final_price=Coalesce(Subquery(cart_products.annotate(total=Sum('final_price')).values('total')), 0)
+        )
+
+
+class CartProductManager(models.Manager):
+
+    def get_cart_products(self, cart):
+        return self.get_queryset().filter(cart=cart).select_related('product__category').order_by('id')
+
+    def add_product(self, cart, product):
+        # One more of the product in the cart without reading the row first, so concurrent adds don't lose increments
+        with transaction.atomic(using=self.db, savepoint=False):
+            if self._supports_upsert():
+                pk = self._upsert(cart, product)
+            else:
+                pk = self._increment(cart, product)
+                if pk is None:
+                    try:
+                        with transaction.atomic(using=self.db):
+                            # save() updates the cart totals itself
+                            return self.create(customer_id=cart.customer_id, cart=cart, product=product).pk
+                    except IntegrityError:
+                        # A concurrent request added the product first
+                        pk = self._increment(cart, product)
+            cart_model = self.model._meta.get_field('cart').related_model
+            cart_model.objects.apply_totals_delta(cart.pk, 1, product.price)
+        return pk
+
+    def _supports_upsert(self):
+        connection = connections[self.db]
+        return connection.vendor == 'postgresql' or (
+            connection.vendor == 'sqlite' and sqlite3.sqlite_version_info >= (3, 35)  # ON CONFLICT and RETURNING
+        )
+
+    def _upsert(self, cart, product):
+        connection = connections[self.db]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (customer_id, cart_id, product_id, qty, final_price) VALUES (%s, %s, %s, 1, %s) '
+                f'ON CONFLICT (cart_id, product_id) DO UPDATE '
+                f'SET qty = {table}.qty + 1, final_price = {table}.final_price + excluded.final_price RETURNING id',
+                [cart.customer_id, cart.pk, product.pk, product.price]
+            )
+            return cursor.fetchone()[0]
+
+    def _increment(self, cart, product):
+        cart_products = self.filter(cart=cart, product=product)
+        if cart_products.update(qty=F('qty') + 1, final_price=F('final_price') + product.price):
+            return cart_products.values_list('pk', flat=True).first()
+        return None
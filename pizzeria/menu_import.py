@@ -0,0 +1,137 @@
+import csv
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .menu_index import menu_index
+from .menu_version import bump_menu_version
+from .models import Pizza, Category, Ingredient
+from .search import update_search_documents
+from .utils import validate_image, schedule_image_processing
+
+MENU_FIELDS = ['name', 'slug', 'price', 'category', 'ingredients', 'description', 'in_stock', 'image']
+REQUIRED_FIELDS = ['name', 'slug', 'price', 'category', 'description', 'image']
+
+
+class MenuImportError(Exception):
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__('\n'.join(errors))
+
+
+def read_menu_rows(file, file_format):
+    # CSV with MENU_FIELDS as the header (ingredients separated by commas) or JSON lines with the same keys
+    try:
+        if file_format == 'csv':
+            return list(csv.DictReader(file))
+        if file_format in ('jsonl', 'json'):
+            return read_json_lines(file)
+    except UnicodeDecodeError:
+        raise MenuImportError(['The menu file is not UTF-8 text'])
+    except csv.Error as e:
+        raise MenuImportError([f'The menu file is not valid CSV: {e}'])
+    raise MenuImportError([f'Unknown menu file format "{file_format}", use csv or jsonl'])
+
+
+def read_json_lines(file):
+    rows, errors = [], []
+    for line, text in enumerate(file, start=1):
+        if not text.strip():
+            continue
+        try:
+            row = json.loads(text)
+        except json.JSONDecodeError as e:
+            errors.append(f'Line {line}: invalid JSON, {e.msg}')
+            continue
+        if not isinstance(row, dict):
+            errors.append(f'Line {line}: a pizza has to be a JSON object')
+            continue
+        rows.append(row)
+    if errors:
+        raise MenuImportError(errors)
+    return rows
+
+
+def parse_ingredients(value):
+    if isinstance(value, str):
+        return [name.strip() for name in value.split(',') if name.strip()]
+    return value or []
+
+
+def parse_in_stock(value):
+    if isinstance(value, str):
+        return value.strip().lower() not in ('false', '0', 'no')
+    return True if value is None else bool(value)
+
+
+@transaction.atomic
+def import_menu(rows, open_image):
+    # open_image(name) returns the image file a row refers to, or None if there is no such file
+    rows = [dict(row, ingredients=parse_ingredients(row.get('ingredients'))) for row in rows]
+    category_names = {row.get('category') for row in rows}
+    ingredient_names = {name for row in rows for name in row['ingredients']}
+    categories = {category.name: category for category in Category.objects.filter(name__in=category_names)}
+    ingredients = {ingredient.name: ingredient for ingredient in Ingredient.objects.filter(name__in=ingredient_names)}
+    slugs = set(Pizza.objects.filter(slug__in=[row.get('slug') for row in rows]).values_list('slug', flat=True))
+    names = set(Pizza.objects.filter(name__in=[row.get('name') for row in rows]).values_list('name', flat=True))
+
+    errors, pizzas = [], []
+    for line, row in enumerate(rows, start=1):
+        row_errors = [f'missing {field}' for field in REQUIRED_FIELDS if not row.get(field)]
+        if row_errors:
+            errors.append(f'Row {line}: {"; ".join(row_errors)}')
+            continue
+        if row['category'] not in categories:
+            row_errors.append(f'unknown category "{row["category"]}"')
+        unknown_ingredients = [name for name in row['ingredients'] if name not in ingredients]
+        if unknown_ingredients:
+            row_errors.append(f'unknown ingredients {", ".join(unknown_ingredients)}')
+        if row['slug'] in slugs:
+            row_errors.append(f'pizza "{row["slug"]}" already exists')
+        slugs.add(row['slug'])
+        if row['name'] in names:
+            row_errors.append(f'pizza named "{row["name"]}" already exists')
+        names.add(row['name'])
+        image = open_image(row['image'])
+        if image is None:
+            row_errors.append(f'no image "{row["image"]}"')
+        else:
+            try:
+                validate_image(image, Pizza.max_image_size, Pizza.max_image_pixels)
+            except Exception as e:
+                row_errors.append(str(e))
+        pizza = Pizza(name=row['name'], slug=row['slug'], price=row['price'], category=categories.get(row['category']),
+                      image=image, description=row['description'], in_stock=parse_in_stock(row.get('in_stock')))
+        try:
+            # Uniqueness is checked above for the whole file at once
+            pizza.full_clean(exclude=['category', 'image'], validate_unique=False)
+        except ValidationError as e:
+            row_errors.extend(f'{field} {"; ".join(messages)}' for field, messages in e.message_dict.items())
+        if row_errors:
+            errors.append(f'Row {line}: {"; ".join(row_errors)}')
+            continue
+        pizzas.append(pizza)
+    if errors:
+        raise MenuImportError(errors)
+
+    pizzas = Pizza.objects.bulk_create(pizzas)
+    if pizzas and pizzas[0].pk is None:
+        # Databases which don't return ids from bulk inserts
+        created = Pizza.objects.in_bulk([pizza.slug for pizza in pizzas], field_name='slug')
+        for pizza in pizzas:
+            pizza.pk = created[pizza.slug].pk
+    Pizza.ingredients.through.objects.bulk_create([
+        Pizza.ingredients.through(pizza_id=pizza.pk, ingredient_id=ingredients[name].pk)
+        for pizza, row in zip(pizzas, rows) for name in row['ingredients']
+    ])
+
+    # bulk_create doesn't send signals
+    update_search_documents([pizza.pk for pizza in pizzas])
+    transaction.on_commit(menu_index.invalidate)
+    bump_menu_version()
+    Category.objects.clear_sidebar_cache()
+    for pizza in pizzas:
+        schedule_image_processing(pizza)
+    return pizzas
@@ -0,0 +1,112 @@
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.core.cache import cache
+
+from .models import Pizza
+
+MENU_INDEX_VERSION_KEY = 'pizzeria:menu_index_version'
+
+
+# In-process inverted index of the menu: ingredient id -> ids of pizzas with it, plus price and category of pizzas
+# in stock. Signals update it in place in the process which changed the menu, other processes see the shared version
+# in the cache change and rebuild their index on the next use. Changes are applied once they are committed.
+class MenuIndex:
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._version = None
+        self._pizzas = {}
+        self._ingredient_pizzas = defaultdict(set)
+
+    def filter_ids(self, ingredient_ids=(), match_any=False, price_gt=None, price_lt=None, category_id=None):
+        with self._lock:
+            self._ensure_built()
+            if ingredient_ids:
+                pizza_sets = sorted((self._ingredient_pizzas.get(pk, set()) for pk in ingredient_ids), key=len)
+                pizza_ids = set.union(*pizza_sets) if match_any else set.intersection(*pizza_sets)
+                candidates = ((pk, self._pizzas[pk]) for pk in pizza_ids if pk in self._pizzas)
+            else:
+                candidates = self._pizzas.items()
+            return sorted(
+                pk for pk, (price, pizza_category_id) in candidates
+                if (price_gt is None or price > price_gt) and (price_lt is None or price < price_lt)
+                and (category_id is None or pizza_category_id == category_id)
+            )
+
+    def update_pizza(self, pizza_id, price, category_id, in_stock):
+        with self._change():
+            if in_stock:
+                self._pizzas[pizza_id] = (price, category_id)
+            else:
+                self._pizzas.pop(pizza_id, None)
+
+    def remove_pizza(self, pizza_id):
+        with self._change():
+            self._pizzas.pop(pizza_id, None)
+            for pizza_ids in self._ingredient_pizzas.values():
+                pizza_ids.discard(pizza_id)
+
+    def remove_ingredient(self, ingredient_id):
+        with self._change():
+            self._ingredient_pizzas.pop(ingredient_id, None)
+
+    def add_ingredients(self, pizza_ids, ingredient_ids):
+        with self._change():
+            for ingredient_id in ingredient_ids:
+                self._ingredient_pizzas[ingredient_id].update(pizza_ids)
+
+    def remove_ingredients(self, pizza_ids, ingredient_ids=None):
+        with self._change():
+            if ingredient_ids is None:
+                ingredient_ids = list(self._ingredient_pizzas)
+            for ingredient_id in ingredient_ids:
+                self._ingredient_pizzas[ingredient_id].difference_update(pizza_ids)
+
+    def invalidate(self):
+        # For menu changes which don't send signals, e.g. bulk_create
+        with self._lock:
+            self._get_shared_version()
+            cache.incr(MENU_INDEX_VERSION_KEY)
+            self._version = None
+
+    def build(self):
+        pizzas = {
+            pk: (price, category_id)
+            for pk, price, category_id in Pizza.objects.filter(in_stock=True).values_list('pk', 'price', 'category_id')
+        }
+        ingredient_pizzas = defaultdict(set)
+        for pizza_id, ingredient_id in Pizza.ingredients.through.objects.values_list('pizza_id', 'ingredient_id'):
+            ingredient_pizzas[ingredient_id].add(pizza_id)
+        with self._lock:
+            self._pizzas = pizzas
+            self._ingredient_pizzas = ingredient_pizzas
+
+    def _ensure_built(self):
+        version = self._get_shared_version()
+        if version != self._version:
+            self.build()
+            self._version = version
+
+    @contextmanager
+    def _change(self):
+        # Changes are applied to the built index and the shared version is bumped, so other processes rebuild theirs
+        with self._lock:
+            shared_version = self._get_shared_version()
+            in_sync = self._version is not None and self._version == shared_version
+            self._version = None
+            try:
+                yield
+            finally:
+                version = cache.incr(MENU_INDEX_VERSION_KEY)
+            # Another process bumping the version in between means a change this index doesn't have
+            self._version = version if in_sync and version == shared_version + 1 else None
+
+    @staticmethod
+    def _get_shared_version():
+        cache.add(MENU_INDEX_VERSION_KEY, 1, None)
+        return cache.get(MENU_INDEX_VERSION_KEY)
+
+
+menu_index = MenuIndex()
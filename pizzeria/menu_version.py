@@ -0,0 +1,37 @@
+from datetime import timedelta
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils import timezone
+
+MENU_VERSION_KEY = 'pizzeria:menu_version'
+
+
+def get_menu_version_timeout():
+    # A cache of its own in every process (locmem) doesn't see the menu changes made by the other processes, there
+    # the version expires, so a change is noticed after MENU_VERSION_LOCAL_TIMEOUT seconds at the latest
+    if isinstance(caches['default'], (LocMemCache, DummyCache)):
+        return settings.MENU_VERSION_LOCAL_TIMEOUT
+    return None
+
+
+def get_menu_version():
+    # (version, last modified), a lost cache entry gives a new version so clients never get a stale 304
+    menu_version = cache.get(MENU_VERSION_KEY)
+    if menu_version is None:
+        cache.add(MENU_VERSION_KEY, (uuid4().hex, timezone.now().replace(microsecond=0)), get_menu_version_timeout())
+        menu_version = cache.get(MENU_VERSION_KEY)
+    return menu_version
+
+
+def bump_menu_version():
+    # Last-Modified has whole seconds, every change moves it forward, so a client which only sends If-Modified-Since
+    # doesn't get a 304 after a second change within the same second
+    last_modified = timezone.now().replace(microsecond=0)
+    menu_version = cache.get(MENU_VERSION_KEY)
+    if menu_version is not None and menu_version[1] >= last_modified:
+        last_modified = menu_version[1] + timedelta(seconds=1)
+    cache.set(MENU_VERSION_KEY, (uuid4().hex, last_modified), get_menu_version_timeout())
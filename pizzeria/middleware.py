@@ -0,0 +1,46 @@
+from django.utils.functional import cached_property
+
+from .models import Cart, Customer
+
+
+class CustomerCart:
+    """Lazily resolves the current user's customer and open cart, at most once per request."""
+
+    def __init__(self, request):
+        self.request = request
+
+    @cached_property
+    def _resolved(self):
+        user = self.request.user
+        if not user.is_authenticated:
+            return None, None
+        cart = Cart.objects.select_related('customer').filter(customer__user=user, in_order=False).first()
+        customer = cart.customer if cart else Customer.objects.filter(user=user).first()
+        if customer:
+            customer.user = user
+        return customer, cart
+
+    @property
+    def customer(self):
+        return self._resolved[0]
+
+    @property
+    def cart(self):
+        return self._resolved[1]
+
+    def get_or_create_cart(self):
+        customer, cart = self._resolved
+        if not cart and customer:
+            cart = Cart.objects.create(customer=customer)
+            self._resolved = customer, cart
+        return cart
+
+
+class CustomerCartMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.customer_cart = CustomerCart(request)
+        return self.get_response(request)
@@ -0,0 +1,23 @@
+# Generated by Django 3.0.7 on 2026-10-18 14:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pizzeria', '0005_auto_20210502_1805'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredient',
+            name='image_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, verbose_name='Image hash'),
+        ),
+        migrations.AddField(
+            model_name='pizza',
+            name='image_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, verbose_name='Image hash'),
+        ),
+    ]
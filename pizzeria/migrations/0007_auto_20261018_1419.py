@@ -0,0 +1,35 @@
+# Generated by Django 3.0.7 on 2026-10-18 14:19
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def snapshot_order_totals(apps, schema_editor):
+    Order = apps.get_model('pizzeria', 'Order')
+    Cart = apps.get_model('pizzeria', 'Cart')
+    carts = Cart.objects.filter(pk=OuterRef('cart_id'))
+    Order.objects.filter(cart__isnull=False).update(
+        total_products=Subquery(carts.values('total_products')[:1]),
+        final_price=Subquery(carts.values('final_price')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pizzeria', '0006_auto_20261018_1416'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='final_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=9, verbose_name='Final price'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_products',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Quantity of products'),
+        ),
+        migrations.RunPython(snapshot_order_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 3.0.7 on 2026-10-18 14:23
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def merge_duplicate_cart_products(apps, schema_editor):
+    # Concurrent adds could create the same product twice in a cart, the rows are merged into the first one
+    CartProduct = apps.get_model('pizzeria', 'CartProduct')
+    duplicates = CartProduct.objects.filter(cart__isnull=False).values('cart', 'product').annotate(
+        rows=Count('id'), total_qty=Sum('qty'), total_price=Sum('final_price')
+    ).filter(rows__gt=1)
+    for duplicate in list(duplicates):
+        cart_products = CartProduct.objects.filter(cart=duplicate['cart'], product=duplicate['product']).order_by('id')
+        first = cart_products.first()
+        cart_products.exclude(pk=first.pk).delete()
+        CartProduct.objects.filter(pk=first.pk).update(
+            qty=duplicate['total_qty'], final_price=duplicate['total_price']
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pizzeria', '0007_auto_20261018_1419'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_cart_products, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartproduct',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='unique_cart_product'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 3.0.7 on 2026-10-18 14:26
+
+from django.db import migrations
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def link_cart_products_to_carts(apps, schema_editor):
+    # Products which were only in the m2m get the FK, carts they are moved to get their totals recalculated
+    Cart = apps.get_model('pizzeria', 'Cart')
+    CartProduct = apps.get_model('pizzeria', 'CartProduct')
+    cart_ids = set()
+    for cart_product_id, cart_id, product_id in Cart.products.through.objects.filter(
+        cartproduct__cart__isnull=True
+    ).values_list('cartproduct_id', 'cart_id', 'cartproduct__product_id'):
+        if not CartProduct.objects.filter(cart_id=cart_id, product_id=product_id).exists():
+            CartProduct.objects.filter(pk=cart_product_id).update(cart_id=cart_id)
+            cart_ids.add(cart_id)
+    totals = CartProduct.objects.filter(cart=OuterRef('pk')).order_by().values('cart')
+    Cart.objects.filter(pk__in=cart_ids).update(
+        total_products=Coalesce(Subquery(totals.annotate(total=Sum('qty')).values('total')), 0),
+        final_price=Coalesce(Subquery(totals.annotate(total=Sum('final_price')).values('total')), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pizzeria', '0008_auto_20261018_1423'),
+    ]
+
+    operations = [
+        migrations.RunPython(link_cart_products_to_carts, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='cart',
+            name='products',
+        ),
+    ]
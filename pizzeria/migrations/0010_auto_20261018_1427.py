@@ -0,0 +1,57 @@
+# Generated by Django 3.0.7 on 2026-10-18 14:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def snapshot_order_items(apps, schema_editor):
+    # Existing orders get their items from the carts they were made from
+    Order = apps.get_model('pizzeria', 'Order')
+    OrderItem = apps.get_model('pizzeria', 'OrderItem')
+    CartProduct = apps.get_model('pizzeria', 'CartProduct')
+    order_ids = dict(Order.objects.filter(cart__isnull=False).values_list('cart_id', 'id'))
+    cart_products = CartProduct.objects.filter(
+        cart_id__in=order_ids, product__isnull=False
+    ).select_related('product__category').order_by('id')
+    OrderItem.objects.bulk_create([
+        OrderItem(order_id=order_ids[cart_product.cart_id], product=cart_product.product,
+                  name=cart_product.product.name, category=cart_product.product.category.name,
+                  price=cart_product.product.price, qty=cart_product.qty, final_price=cart_product.final_price)
+        for cart_product in cart_products.iterator()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pizzeria', '0009_remove_cart_products'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderItem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, verbose_name='Name')),
+                ('category', models.CharField(max_length=255, verbose_name='Category')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=9, verbose_name='Price')),
+                ('qty', models.PositiveSmallIntegerField(verbose_name='Qty')),
+                ('final_price', models.DecimalField(decimal_places=2, max_digits=9, verbose_name='Final price')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['customer', '-created_at', '-id'], name='order_customer_created_idx'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='order',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='pizzeria.Order', verbose_name='Order'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='product',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='pizzeria.Pizza', verbose_name='Pizza'),
+        ),
+        migrations.RunPython(snapshot_order_items, migrations.RunPython.noop),
+    ]
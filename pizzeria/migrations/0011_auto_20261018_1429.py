@@ -0,0 +1,29 @@
+# Generated by Django 3.0.7 on 2026-10-18 14:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pizzeria', '0010_auto_20261018_1427'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(condition=models.Q(in_order=False), fields=['customer'], name='cart_open_customer_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['customer', 'status'], name='order_customer_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pizza',
+            index=models.Index(fields=['category', 'in_stock'], name='pizza_category_in_stock_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pizza',
+            index=models.Index(fields=['in_stock', 'price'], name='pizza_in_stock_price_idx'),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 3.0.7 on 2026-10-18 14:31
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+FTS_TABLE = 'pizzeria_pizzasearchdocument_fts'
+DOCUMENT_TABLE = 'pizzeria_pizzasearchdocument'
+
+SEARCH_INDEX_SQL = {
+    'postgresql': [
+        f"CREATE INDEX pizza_search_document_idx ON {DOCUMENT_TABLE} USING GIN (to_tsvector('simple', document))",
+    ],
+    # An external content FTS5 table, the triggers keep it in sync with the documents table. SQLite drops them
+    # if a later migration rebuilds the documents table, such a migration has to create them again
+    'sqlite': [
+        f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(document, content='{DOCUMENT_TABLE}', content_rowid='pizza_id')",
+        f"CREATE TRIGGER {DOCUMENT_TABLE}_ai AFTER INSERT ON {DOCUMENT_TABLE} BEGIN "
+        f"INSERT INTO {FTS_TABLE}(rowid, document) VALUES (new.pizza_id, new.document); END",
+        f"CREATE TRIGGER {DOCUMENT_TABLE}_ad AFTER DELETE ON {DOCUMENT_TABLE} BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, document) VALUES ('delete', old.pizza_id, old.document); END",
+        f"CREATE TRIGGER {DOCUMENT_TABLE}_au AFTER UPDATE ON {DOCUMENT_TABLE} BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, document) VALUES ('delete', old.pizza_id, old.document); "
+        f"INSERT INTO {FTS_TABLE}(rowid, document) VALUES (new.pizza_id, new.document); END",
+    ],
+}
+DROP_SEARCH_INDEX_SQL = {
+    'postgresql': ['DROP INDEX pizza_search_document_idx'],
+    'sqlite': [
+        f'DROP TRIGGER {DOCUMENT_TABLE}_ai', f'DROP TRIGGER {DOCUMENT_TABLE}_ad', f'DROP TRIGGER {DOCUMENT_TABLE}_au',
+        f'DROP TABLE {FTS_TABLE}',
+    ],
+}
+
+
+def create_search_index(apps, schema_editor):
+    for sql in SEARCH_INDEX_SQL.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    for sql in DROP_SEARCH_INDEX_SQL.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def create_search_documents(apps, schema_editor):
+    Pizza = apps.get_model('pizzeria', 'Pizza')
+    PizzaSearchDocument = apps.get_model('pizzeria', 'PizzaSearchDocument')
+    pizzas = Pizza.objects.select_related('category').prefetch_related('ingredients')
+    PizzaSearchDocument.objects.bulk_create([
+        PizzaSearchDocument(pizza=pizza, document=' '.join([
+            pizza.name, pizza.category.name, *(ingredient.name for ingredient in pizza.ingredients.all()),
+            pizza.description
+        ]))
+        for pizza in pizzas
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pizzeria', '0011_auto_20261018_1429'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PizzaSearchDocument',
+            fields=[
+                ('pizza', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='pizzeria.Pizza', verbose_name='Pizza')),
+                ('document', models.TextField(verbose_name='Document')),
+            ],
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.RunPython(create_search_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.0.7 on 2026-10-18 14:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('pizzeria', '0012_pizzasearchdocument'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='version',
+            field=models.PositiveIntegerField(default=0, verbose_name='Version of the status'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'order_date_time', 'id'], name='order_status_date_time_idx'),
+        ),
+    ]
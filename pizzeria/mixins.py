@@ -1,26 +1,37 @@
+from django.conf import settings
+from django.urls import reverse
 from django.views.generic.base import View
 from django.views.generic.detail import SingleObjectMixin
 
-from .models import Category, Pizza, Cart, Customer
+from .idempotency import (
+    IDEMPOTENCY_KEY_HEADER, get_idempotency_key, get_idempotency_cache_key, get_request_fingerprint,
+    claim_idempotency_key, wait_for_response, store_redirect, release_idempotency_key, replay_response
+)
+from .models import Category, Pizza
 
 
 class CategoryMixin(SingleObjectMixin):
 
+    def get_object(self, queryset=None):
+        # DetailView.get and the context building both need the object, so it's fetched once per request
+        if queryset is not None:
+            return super().get_object(queryset)
+        if not hasattr(self, '_object'):
+            self._object = super().get_object()
+        return self._object
+
     def get_context_data(self, **kwargs):
-        if isinstance(self.get_object(), Category):
-            context = super().get_context_data()
-            context['categories'] = Category.objects.get_categories_for_sidebar()
-            context['products'] = Pizza.objects.filter(category=self.get_object(), in_stock=True)
-            return context
         context = super().get_context_data()
         context['categories'] = Category.objects.get_categories_for_sidebar()
+        if isinstance(self.object, Category):
+            context['products'] = Pizza.objects.filter(category=self.object, in_stock=True)
         return context
 
 
 class CustomerMixin(View):
 
     def dispatch(self, request, *args, **kwargs):
-        self.customer = Customer.objects.get(user=request.user)
+        self.customer = request.customer_cart.customer
         return super().dispatch(request, *args, **kwargs)
 
     def get_context_data(self, **kwargs):
@@ -30,18 +41,46 @@ class CustomerMixin(View):
 
 
 class CartMixin(View):
+    # Only views that put something into the cart need it to exist, others just read the open cart if there is one
+    create_cart = False
 
-    def dispatch(self, request, *args, **kwargs):
-        if request.user.is_authenticated:
-            customer = Customer.objects.filter(user=request.user).first()
-            cart = Cart.objects.filter(customer=customer, in_order=False).first()
-            if not cart:
-                cart = Cart.objects.create(customer=customer)
-        self.cart = cart
-        self.cart.save()
-        return super().dispatch(request, *args, **kwargs)
+    @property
+    def cart(self):
+        if self.create_cart:
+            return self.request.customer_cart.get_or_create_cart()
+        return self.request.customer_cart.cart
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data()
         context['cart'] = self.cart
         return context
+
+
+class IdempotentMixin(View):
+    # Requests repeated with the same idempotency key get the response of the first one instead of being applied again
+    idempotency_pending_url = 'cart'
+
+    def dispatch(self, request, *args, **kwargs):
+        key = get_idempotency_key(request)
+        if not key or not request.user.is_authenticated:
+            return super().dispatch(request, *args, **kwargs)
+        cache_key = get_idempotency_cache_key(request, key)
+        fingerprint = get_request_fingerprint(request)
+        stored = claim_idempotency_key(cache_key, fingerprint)
+        if stored is not None:
+            if IDEMPOTENCY_KEY_HEADER in request.META:
+                return replay_response(stored, fingerprint)
+            # A double submitted page waits for the first request and is sent where it was sent
+            stored = wait_for_response(cache_key, settings.IDEMPOTENCY_WAIT_TIMEOUT) or stored
+            return replay_response(stored, fingerprint, reverse(self.idempotency_pending_url))
+        try:
+            response = super().dispatch(request, *args, **kwargs)
+        except Exception:
+            release_idempotency_key(cache_key)
+            raise
+        # Mutations redirect when they are done, anything else (e.g. an invalid form) may be retried
+        if response.status_code in (301, 302, 303):
+            store_redirect(cache_key, fingerprint, response)
+        else:
+            release_idempotency_key(cache_key)
+        return response
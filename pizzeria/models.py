@@ -1,28 +1,37 @@
 from django.contrib.auth import get_user_model
-from django.db import models
-from django.db.models import Sum
+from django.db import models, transaction
+from django.db.models import DEFERRED
 from django.urls import reverse
 
-from pizzeria.managers import CategoryManager
-from pizzeria.utils import get_image, change_image_resolution
+from pizzeria.managers import CategoryManager, CartManager, CartProductManager
+from pizzeria.utils import get_image, get_srcset, has_new_image, validate_image, schedule_image_processing
 
 
 class Pizza(models.Model):
     min_resolution = (600, 400)
     max_resolution = (650, 450)
     max_image_size = 3145728
+    max_image_pixels = 36000000
     new_image_width = 625
     new_image_height = 425
+    image_variants = {'thumbnail': 160, 'list': 320, 'detail': 625}
 
     name = models.CharField(max_length=255, verbose_name='Name', unique=True)
     ingredients = models.ManyToManyField('Ingredient', related_name='related_pizza', verbose_name='Ingredients')
     price = models.DecimalField(max_digits=9, decimal_places=2, verbose_name='Price')
     category = models.ForeignKey('Category', on_delete=models.CASCADE, verbose_name='Category')
     image = models.ImageField(verbose_name='Image')
+    image_hash = models.CharField(max_length=64, blank=True, editable=False, verbose_name='Image hash')
     description = models.TextField(verbose_name='Description')
     in_stock = models.BooleanField(default=True, verbose_name='In stock')
     slug = models.SlugField(unique=True, verbose_name='Slug')
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['category', 'in_stock'], name='pizza_category_in_stock_idx'),
+            models.Index(fields=['in_stock', 'price'], name='pizza_in_stock_price_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -30,45 +39,58 @@ class Pizza(models.Model):
         return reverse('product_detail', kwargs={'slug': self.slug})
 
     def save(self, *args, **kwargs):
-        self.image = change_image_resolution(image=self.image,
-                                             min_resolution=self.min_resolution,
-                                             max_resolution=self.max_resolution,
-                                             max_image_size=self.max_image_size,
-                                             new_image_width=self.new_image_width,
-                                             new_image_height=self.new_image_height)
+        new_image = has_new_image(self)
+        if new_image:
+            validate_image(self.image, self.max_image_size, self.max_image_pixels)
         super().save(*args, **kwargs)
+        if new_image:
+            schedule_image_processing(self)
 
     def get_image(self):
         image = get_image(self, self.new_image_width, self.new_image_height)
         return image
 
+    def get_srcset(self):
+        return get_srcset(self, '.jpg')
+
+    def get_webp_srcset(self):
+        return get_srcset(self, '.webp')
+
 
 class Ingredient(models.Model):
     min_resolution = (100, 100)
     max_resolution = (100, 100)
     max_image_size = 3145728
+    max_image_pixels = 36000000
     new_image_width = 100
     new_image_height = 100
+    image_variants = {'thumbnail': 50, 'detail': 100}
 
     image = models.ImageField(verbose_name='Image', null=True)
+    image_hash = models.CharField(max_length=64, blank=True, editable=False, verbose_name='Image hash')
     name = models.CharField(max_length=50, verbose_name='Name')
 
     def __str__(self):
         return self.name
 
     def save(self, *args, **kwargs):
-        self.image = change_image_resolution(image=self.image,
-                                             min_resolution=self.min_resolution,
-                                             max_resolution=self.max_resolution,
-                                             max_image_size=self.max_image_size,
-                                             new_image_width=self.new_image_width,
-                                             new_image_height=self.new_image_height)
+        new_image = has_new_image(self)
+        if new_image:
+            validate_image(self.image, self.max_image_size, self.max_image_pixels)
         super().save(*args, **kwargs)
+        if new_image:
+            schedule_image_processing(self)
 
     def get_image(self):
         image = get_image(self, self.new_image_width, self.new_image_height)
         return image
 
+    def get_srcset(self):
+        return get_srcset(self, '.jpg')
+
+    def get_webp_srcset(self):
+        return get_srcset(self, '.webp')
+
 
 class Category(models.Model):
     name = models.CharField(max_length=255, verbose_name='Name', unique=True)
@@ -83,6 +105,17 @@ class Category(models.Model):
         return reverse('category_list', kwargs={'slug': self.slug})
 
 
+# Text the menu search looks in: name, category, ingredients and description of a pizza, kept up to date by signals.
+# The database indexes it with full-text search, see pizzeria/search.py
+class PizzaSearchDocument(models.Model):
+    pizza = models.OneToOneField(Pizza, on_delete=models.CASCADE, primary_key=True, related_name='search_document',
+                                 verbose_name='Pizza')
+    document = models.TextField(verbose_name='Document')
+
+    def __str__(self):
+        return str(self.pizza_id)
+
+
 class CartProduct(models.Model):
     customer = models.ForeignKey('Customer', on_delete=models.CASCADE, verbose_name='Owner')
     cart = models.ForeignKey('Cart', related_name='related_products', null=True,
@@ -91,32 +124,71 @@ class CartProduct(models.Model):
     qty = models.PositiveSmallIntegerField(default=1, verbose_name='Qty')
     final_price = models.DecimalField(max_digits=9, decimal_places=2, default=0, verbose_name='Final price')
 
+    objects = CartProductManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['cart', 'product'], name='unique_cart_product'),
+        ]
+
     def __str__(self):
         return f'{self.customer}\'s cart product'
 
     def save(self, **kwargs):
         self.final_price = self.product.price * self.qty
-        super().save(**kwargs)
+        with transaction.atomic():
+            stored_totals = self._get_stored_totals()
+            super().save(**kwargs)
+            self._update_cart_totals(stored_totals, self.cart_id, self.qty, self.final_price)
+
+    def delete(self, **kwargs):
+        # The post_delete receiver takes the row off the cart totals (also for cascades and queryset deletes),
+        # it gets the stored values rather than the ones this instance was loaded with
+        with transaction.atomic():
+            self.cart_id, self.qty, self.final_price = self._get_stored_totals()
+            return super().delete(**kwargs)
+
+    def _get_stored_totals(self):
+        # (cart_id, qty, final_price) of the row being overwritten, read under a lock instead of remembered from
+        # when this instance was loaded, so a change made by somebody else in between isn't counted twice
+        if self.pk is None:
+            return None, 0, 0
+        stored_totals = CartProduct.objects.select_for_update().filter(pk=self.pk).values_list(
+            'cart_id', 'qty', 'final_price'
+        ).first()
+        return stored_totals or (None, 0, 0)
+
+    @staticmethod
+    def _update_cart_totals(stored_totals, cart_id, qty, final_price):
+        stored_cart_id, stored_qty, stored_final_price = stored_totals
+        if stored_cart_id == cart_id:
+            if cart_id is not None and (qty != stored_qty or final_price != stored_final_price):
+                Cart.objects.apply_totals_delta(cart_id, qty - stored_qty, final_price - stored_final_price)
+        else:
+            if stored_cart_id is not None:
+                Cart.objects.apply_totals_delta(stored_cart_id, -stored_qty, -stored_final_price)
+            if cart_id is not None:
+                Cart.objects.apply_totals_delta(cart_id, qty, final_price)
 
 
 class Cart(models.Model):
     customer = models.ForeignKey('Customer', on_delete=models.CASCADE, verbose_name='Owner', null=True)
-    products = models.ManyToManyField(CartProduct, blank=True, related_name='related_cart', verbose_name='Products')
     total_products = models.PositiveSmallIntegerField(null=True, blank=True, verbose_name='Quantity of products')
     final_price = models.DecimalField(max_digits=9, decimal_places=2, null=True, blank=True, verbose_name='Final price')
     in_order = models.BooleanField(default=False)
     for_anon_user = models.BooleanField(default=False)
 
+    objects = CartManager()
+
+    class Meta:
+        indexes = [
+            # Every request looks up the customer's open cart, ordered carts are only read with their orders
+            models.Index(fields=['customer'], name='cart_open_customer_idx', condition=models.Q(in_order=False)),
+        ]
+
     def __str__(self):
         return f'{self.customer}\'s cart'
 
-    def save(self, **kwargs):
-        super().save(**kwargs)
-        products_data = self.products.all().aggregate(price=Sum('final_price'), total_products=Sum('qty'))
-        self.total_products = products_data['total_products']
-        self.final_price = products_data['price']
-        super().save(force_update=True)
-
 
 class Customer(models.Model):
     user = models.OneToOneField(get_user_model(), on_delete=models.CASCADE, verbose_name='Customer')
@@ -144,6 +216,13 @@ class Order(models.Model):
         (STATUS_COMPLETED, 'Order\'s completed')
     )
 
+    # The status an order has to be in to be moved to the key status by the kitchen
+    STATUS_TRANSITIONS = {
+        STATUS_IN_PROGRESS: STATUS_NEW,
+        STATUS_READY: STATUS_IN_PROGRESS,
+        STATUS_COMPLETED: STATUS_READY,
+    }
+
     DELIVERY_ON = 'delivery'
     DELIVERY_OFF = 'pickup'
 
@@ -165,11 +244,60 @@ class Order(models.Model):
     delivery = models.CharField(max_length=100, verbose_name='Delivery',
                                 choices=DELIVERY_CHOICES, default=DELIVERY_OFF)
     comment = models.TextField(null=True, blank=True, verbose_name='Comment to the order')
+    total_products = models.PositiveSmallIntegerField(default=0, verbose_name='Quantity of products')
+    final_price = models.DecimalField(max_digits=9, decimal_places=2, default=0, verbose_name='Final price')
+    version = models.PositiveIntegerField(default=0, verbose_name='Version of the status')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='Order\'s created at')
     order_date_time = models.DateTimeField(auto_now_add=False, verbose_name='Order\'s delivery date and time')
 
+    # Status as it is stored in the database (DEFERRED if loaded without it), used to publish only the changes of it
+    _stored_status = None
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', '-created_at', '-id'], name='order_customer_created_idx'),
+            models.Index(fields=['customer', 'status'], name='order_customer_status_idx'),
+            models.Index(fields=['status', 'order_date_time', 'id'], name='order_status_date_time_idx'),
+        ]
+
     def __str__(self):
         return str(self.id)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._stored_status = dict(zip(field_names, values)).get('status', DEFERRED)
+        return instance
+
+    def has_status_changed(self):
+        if self._stored_status is DEFERRED:
+            # Loaded without the status and it wasn't set since, so it can't have changed
+            if 'status' in self.get_deferred_fields():
+                return False
+            self._stored_status = Order.objects.filter(pk=self.pk).values_list('status', flat=True).first()
+        return self.status != self._stored_status
+
+    def save(self, **kwargs):
+        # Every status change makes the version a client has seen stale, see kitchen.py
+        if self.pk is not None and self.has_status_changed():
+            self.version += 1
+        super().save(**kwargs)
+        if 'status' not in self.get_deferred_fields():
+            self._stored_status = self.status
+
     def get_absolute_url(self):
         return reverse('order_view', kwargs={'pk': self.pk})
+
+
+# What was ordered, copied from the cart at checkout so the order doesn't change with the cart or the menu
+class OrderItem(models.Model):
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items', verbose_name='Order')
+    product = models.ForeignKey(Pizza, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='Pizza')
+    name = models.CharField(max_length=255, verbose_name='Name')
+    category = models.CharField(max_length=255, verbose_name='Category')
+    price = models.DecimalField(max_digits=9, decimal_places=2, verbose_name='Price')
+    qty = models.PositiveSmallIntegerField(verbose_name='Qty')
+    final_price = models.DecimalField(max_digits=9, decimal_places=2, verbose_name='Final price')
+
+    def __str__(self):
+        return f'{self.qty} x {self.name}'
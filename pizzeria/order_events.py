@@ -0,0 +1,100 @@
+import asyncio
+import json
+import threading
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+
+# Fans the order status events out to the streams of the same process. Events are published from the threads
+# of the views, the streams read them in the event loop of the ASGI server.
+class InProcessBroker:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def publish(self, order_id, event):
+        with self._lock:
+            subscribers = list(self._subscribers.get(order_id, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(queue.put_nowait, event)
+
+    @asynccontextmanager
+    async def subscribe(self, order_id):
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue())
+        with self._lock:
+            self._subscribers[order_id].add(subscriber)
+        try:
+            yield subscriber[1]
+        finally:
+            with self._lock:
+                self._subscribers[order_id].discard(subscriber)
+                if not self._subscribers[order_id]:
+                    del self._subscribers[order_id]
+
+
+# Fans the events out through Redis pub/sub, so an order changed in one process reaches the streams of all of them
+class RedisBroker:
+
+    def __init__(self):
+        try:
+            import redis
+            import redis.asyncio
+        except ImportError:
+            raise ImproperlyConfigured('RedisBroker needs the redis package, pip install redis')
+        self._redis = redis
+        self._client = redis.Redis.from_url(settings.ORDER_EVENTS_REDIS_URL)
+
+    @staticmethod
+    def get_channel(order_id):
+        return f'pizzeria:order_events:{order_id}'
+
+    def publish(self, order_id, event):
+        self._client.publish(self.get_channel(order_id), json.dumps(event))
+
+    @asynccontextmanager
+    async def subscribe(self, order_id):
+        client = self._redis.asyncio.Redis.from_url(settings.ORDER_EVENTS_REDIS_URL)
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(self.get_channel(order_id))
+        queue = asyncio.Queue()
+
+        async def read_messages():
+            async for message in pubsub.listen():
+                await queue.put(json.loads(message['data']))
+
+        reader = asyncio.ensure_future(read_messages())
+        try:
+            yield queue
+        finally:
+            reader.cancel()
+            await pubsub.unsubscribe()
+            await pubsub.close()
+            await client.close()
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(settings.ORDER_EVENTS_BROKER)()
+        return _broker
+
+
+def get_status_event(order_id, status):
+    return {'id': order_id, 'status': status}
+
+
+def publish_order_status(order_id, status):
+    # Subscribers only hear about committed changes, a rolled back status was never real
+    event = get_status_event(order_id, status)
+    transaction.on_commit(lambda: get_broker().publish(order_id, event))
@@ -0,0 +1,102 @@
+import asyncio
+import json
+import re
+from importlib import import_module
+from io import BytesIO
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import auth
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+from .models import Order
+from .order_events import get_broker, get_status_event
+
+ORDER_EVENTS_PATH = re.compile(r'^/api/order/(?P<order_id>\d+)/events/$')
+
+
+def get_stream_user(request):
+    # The same users as the site (session cookie) and the API (token header) have
+    request.session = import_module(settings.SESSION_ENGINE).SessionStore(
+        request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    )
+    user = auth.get_user(request)
+    if not user.is_authenticated:
+        try:
+            user, _ = TokenAuthentication().authenticate(request) or (user, None)
+        except AuthenticationFailed:
+            pass
+    return user
+
+
+def get_stream_order_status(scope, order_id):
+    # Returns (http status, order status), the kitchen (staff) sees every order, a customer only theirs
+    try:
+        user = get_stream_user(ASGIRequest(scope, BytesIO()))
+        if not user.is_authenticated:
+            return 403, None
+        orders = Order.objects.filter(pk=order_id)
+        if not user.is_staff:
+            orders = orders.filter(customer__user=user)
+        status = orders.values_list('status', flat=True).first()
+        return (200, status) if status else (404, None)
+    finally:
+        close_old_connections()
+
+
+def format_event(event):
+    return f'event: status\ndata: {json.dumps(event)}\n\n'.encode()
+
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def get_next_event(events, disconnected, timeout):
+    next_event = asyncio.ensure_future(events.get())
+    await asyncio.wait({next_event, disconnected}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+    if not next_event.done():
+        next_event.cancel()
+        return None
+    return next_event.result()
+
+
+async def order_status_stream(scope, receive, send, order_id):
+    # Server-Sent Events with the status of the order, the current one first and then every change until the order
+    # is completed. Served by the event loop, an open stream doesn't hold a thread or a database connection.
+    async with get_broker().subscribe(order_id) as events:
+        # Subscribed before reading the status, so a change made in between isn't lost
+        response_status, status = await sync_to_async(get_stream_order_status, thread_sensitive=False)(
+            scope, order_id
+        )
+        if response_status != 200:
+            await send({'type': 'http.response.start', 'status': response_status,
+                        'headers': [(b'content-type', b'text/plain')]})
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no'),
+        ]})
+        disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+        try:
+            await send({'type': 'http.response.body', 'body': format_event(get_status_event(order_id, status)),
+                        'more_body': True})
+            while status != Order.STATUS_COMPLETED:
+                event = await get_next_event(events, disconnected, settings.ORDER_EVENTS_HEARTBEAT)
+                if disconnected.done():
+                    return
+                if event is None:
+                    body = b': keepalive\n\n'
+                elif event['status'] == status:
+                    continue
+                else:
+                    status = event['status']
+                    body = format_event(event)
+                await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            disconnected.cancel()
@@ -0,0 +1,54 @@
+import re
+
+from django.db import connections, transaction
+from django.db.models.expressions import RawSQL
+
+from .models import Pizza, PizzaSearchDocument
+
+# SQLite FTS5 table over the documents, filled by triggers on the documents table (see the migration creating it)
+SEARCH_INDEX_TABLE = 'pizzeria_pizzasearchdocument_fts'
+
+
+def get_search_terms(query):
+    return re.findall(r'\w+', query.lower())
+
+
+def get_search_document(pizza):
+    ingredients = [ingredient.name for ingredient in pizza.ingredients.all()]
+    return ' '.join([pizza.name, pizza.category.name, *ingredients, pizza.description])
+
+
+def update_search_documents(pizza_ids):
+    pizzas = Pizza.objects.filter(pk__in=pizza_ids).select_related('category').prefetch_related('ingredients')
+    documents = [PizzaSearchDocument(pizza=pizza, document=get_search_document(pizza)) for pizza in pizzas]
+    with transaction.atomic():
+        PizzaSearchDocument.objects.filter(pizza__in=pizza_ids).delete()
+        PizzaSearchDocument.objects.bulk_create(documents)
+
+
+def search_pizzas(queryset, query):
+    # Pizzas with all the words of the query (or words starting with them), the most relevant first
+    terms = get_search_terms(query)
+    if not terms:
+        return queryset
+    pizza_table = Pizza._meta.db_table
+    document_table = PizzaSearchDocument._meta.db_table
+    # The SQL depends on the database the queryset is read from, not on the default one
+    vendor = connections[queryset.db].vendor
+    if vendor == 'postgresql':
+        match = ' & '.join(f'{term}:*' for term in terms)
+        vector = "to_tsvector('simple', document)"
+        matches = RawSQL(f"SELECT pizza_id FROM {document_table} WHERE {vector} @@ to_tsquery('simple', %s)", [match])
+        rank = RawSQL(f"SELECT ts_rank({vector}, to_tsquery('simple', %s)) FROM {document_table} "
+                      f"WHERE pizza_id = {pizza_table}.id", [match])
+        return queryset.filter(pk__in=matches).annotate(search_rank=rank).order_by('-search_rank', 'pk')
+    if vendor == 'sqlite':
+        match = ' '.join(f'"{term}"*' for term in terms)
+        matches = RawSQL(f'SELECT rowid FROM {SEARCH_INDEX_TABLE} WHERE {SEARCH_INDEX_TABLE} MATCH %s', [match])
+        # FTS5 rank is bm25, lower is better
+        rank = RawSQL(f'SELECT rank FROM {SEARCH_INDEX_TABLE} WHERE {SEARCH_INDEX_TABLE} MATCH %s '
+                      f'AND rowid = {pizza_table}.id', [match])
+        return queryset.filter(pk__in=matches).annotate(search_rank=rank).order_by('search_rank', 'pk')
+    for term in terms:
+        queryset = queryset.filter(search_document__document__icontains=term)
+    return queryset
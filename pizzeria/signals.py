@@ -0,0 +1,108 @@
+from django.db import transaction
+from django.db.models.signals import post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .menu_index import menu_index
+from .menu_version import bump_menu_version
+from .models import Pizza, Category, Ingredient, Order, Cart, CartProduct
+from .order_events import publish_order_status
+from .search import update_search_documents
+
+
+@receiver([post_save, post_delete], sender=Pizza)
+@receiver([post_save, post_delete], sender=Category)
+def clear_sidebar_cache(sender, **kwargs):
+    Category.objects.clear_sidebar_cache()
+
+
+@receiver([post_save, post_delete], sender=Pizza)
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Ingredient)
+@receiver(m2m_changed, sender=Pizza.ingredients.through)
+def update_menu_version(sender, **kwargs):
+    bump_menu_version()
+
+
+# The index is changed only after the commit, a rolled back change never gets into it
+@receiver(post_save, sender=Pizza)
+def update_menu_index(sender, instance, **kwargs):
+    values = instance.pk, instance.price, instance.category_id, instance.in_stock
+    transaction.on_commit(lambda: menu_index.update_pizza(*values))
+
+
+@receiver(post_delete, sender=Pizza)
+def remove_pizza_from_menu_index(sender, instance, **kwargs):
+    pizza_id = instance.pk
+    transaction.on_commit(lambda: menu_index.remove_pizza(pizza_id))
+
+
+@receiver(post_delete, sender=Ingredient)
+def remove_ingredient_from_menu_index(sender, instance, **kwargs):
+    ingredient_id = instance.pk
+    transaction.on_commit(lambda: menu_index.remove_ingredient(ingredient_id))
+
+
+@receiver(m2m_changed, sender=Pizza.ingredients.through)
+def update_menu_index_ingredients(sender, instance, action, reverse, pk_set, **kwargs):
+    instance_id = instance.pk
+    if action == 'post_clear':
+        if reverse:
+            transaction.on_commit(lambda: menu_index.remove_ingredient(instance_id))
+        else:
+            transaction.on_commit(lambda: menu_index.remove_ingredients([instance_id]))
+    elif action in ('post_add', 'post_remove'):
+        pizza_ids, ingredient_ids = (set(pk_set), [instance_id]) if reverse else ([instance_id], set(pk_set))
+        change = menu_index.add_ingredients if action == 'post_add' else menu_index.remove_ingredients
+        transaction.on_commit(lambda: change(pizza_ids, ingredient_ids))
+
+
+@receiver(post_save, sender=Pizza)
+def update_pizza_search_document(sender, instance, **kwargs):
+    update_search_documents([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+def update_category_search_documents(sender, instance, created, **kwargs):
+    if not created:
+        update_search_documents(instance.pizza_set.values('pk'))
+
+
+@receiver(post_save, sender=Ingredient)
+def update_ingredient_search_documents(sender, instance, created, **kwargs):
+    if not created:
+        update_search_documents(instance.related_pizza.values('pk'))
+
+
+@receiver(pre_delete, sender=Ingredient)
+def remember_ingredient_pizzas(sender, instance, **kwargs):
+    # The ingredient's pizzas can't be found after it's deleted
+    instance.search_pizza_ids = list(instance.related_pizza.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Ingredient)
+def update_deleted_ingredient_search_documents(sender, instance, **kwargs):
+    update_search_documents(instance.search_pizza_ids)
+
+
+@receiver(m2m_changed, sender=Pizza.ingredients.through)
+def update_ingredients_search_documents(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear' and reverse:
+        remember_ingredient_pizzas(sender, instance)
+    elif action == 'post_clear':
+        update_search_documents(instance.search_pizza_ids if reverse else [instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        update_search_documents(pk_set if reverse else [instance.pk])
+
+
+@receiver(post_delete, sender=CartProduct)
+def update_cart_totals(sender, instance, **kwargs):
+    # Also sent for the products deleted with their pizza or by a queryset delete(), which skip CartProduct.delete()
+    if instance.cart_id is not None:
+        Cart.objects.apply_totals_delta(instance.cart_id, -instance.qty, -instance.final_price)
+
+
+@receiver(post_save, sender=Order)
+def publish_order_status_change(sender, instance, **kwargs):
+    # Order.save() updates _stored_status only after post_save
+    if instance.has_status_changed():
+        publish_order_status(instance.pk, instance.status)
@@ -0,0 +1,29 @@
+from django import template
+
+from ..fragment_cache import render_cached_fragment
+
+register = template.Library()
+
+
+class MenuFragmentNode(template.Node):
+
+    def __init__(self, nodelist, fragment_name, vary_on):
+        self.nodelist = nodelist
+        self.fragment_name = fragment_name
+        self.vary_on = vary_on
+
+    def render(self, context):
+        vary_on = [str(var.resolve(context)) for var in self.vary_on]
+        return render_cached_fragment(self.fragment_name, vary_on, context, self.nodelist.render)
+
+
+# {% menu_cache product_grid filter_key %} ... {% endmenu_cache %} caches the contents of the block until the menu
+# changes, separately for every combination of the arguments after the fragment name
+@register.tag('menu_cache')
+def do_menu_cache(parser, token):
+    nodelist = parser.parse(('endmenu_cache',))
+    parser.delete_first_token()
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError(f'"{bits[0]}" tag requires at least one argument')
+    return MenuFragmentNode(nodelist, bits[1], [parser.compile_filter(bit) for bit in bits[2:]])
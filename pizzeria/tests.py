@@ -1,3 +1,1057 @@
-from django.test import TestCase
+import asyncio
+import re
+import shutil
+import tempfile
+import threading
+import warnings
+from datetime import datetime, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from PIL import Image
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command, CommandError
+from django.db import connection, transaction, IntegrityError
+from django.db.models.signals import post_save
+from django.http import HttpResponse
+from django.test import (
+    RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+)
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from pizza.asgi import ASGIHandler
+
+from .api.pagination import OrderHistoryPagination, KitchenQueuePagination
+from .filters import PizzaFilter, IndexedPizzaFilter
+from .fragment_cache import get_fragment_cache_stats
+from .idempotency import get_idempotency_cache_key, get_request_fingerprint, claim_idempotency_key
+from .menu_import import import_menu, read_menu_rows, MenuImportError
+from .menu_index import menu_index, MENU_INDEX_VERSION_KEY
+from .menu_version import bump_menu_version
+from .models import Pizza, Ingredient, Category, CartProduct, Cart, Customer, Order, OrderItem
+from .order_events import InProcessBroker
+from .order_stream import get_stream_order_status, format_event
+from .search import search_pizzas
+from .signals import publish_order_status_change
+from .views import ProfileDetailView
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+def make_image(name='pizza.jpg', size=(625, 425)):
+    file_stream = BytesIO()
+    Image.new('RGB', size).save(file_stream, 'JPEG')
+    return SimpleUploadedFile(name, file_stream.getvalue(), content_type='image/jpeg')
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, IMAGE_PROCESSING_ASYNC=False)
+class PizzeriaTestCase(TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='john', password='password', first_name='John', last_name='Doe')
+        cls.customer = Customer.objects.create(user=cls.user, phone_number='380123456789', address='Main st.')
+        cls.category = Category.objects.create(name='Meat', slug='meat')
+        cls.salami = Ingredient.objects.create(name='Salami', image=make_image('salami.jpg', (100, 100)))
+        cls.olives = Ingredient.objects.create(name='Olives', image=make_image('olives.jpg', (100, 100)))
+        cls.pepperoni = cls.create_pizza('Pepperoni', Decimal('10.00'), [cls.salami])
+        cls.mediterranean = cls.create_pizza('Mediterranean', Decimal('12.50'), [cls.salami, cls.olives])
+
+    @classmethod
+    def create_pizza(cls, name, price, ingredients, **kwargs):
+        pizza = Pizza.objects.create(name=name, slug=name.lower(), price=price, category=cls.category,
+                                     image=make_image(f'{name.lower()}.jpg'), description=name, **kwargs)
+        pizza.ingredients.set(ingredients)
+        return pizza
+
+    def create_order(self):
+        cart = Cart.objects.create(customer=self.customer, in_order=True)
+        CartProduct.objects.create(customer=self.customer, cart=cart, product=self.mediterranean)
+        order = Order.objects.create(customer=self.customer, cart=cart, first_name='John', last_name='Doe',
+                                     phone='380123456789', order_date_time=datetime.now() + timedelta(hours=2))
+        OrderItem.objects.create(order=order, product=self.mediterranean, name='Mediterranean', category='Meat',
+                                 price=Decimal('12.50'), qty=1, final_price=Decimal('12.50'))
+        self.customer.orders.add(order)
+        return order
+
+
+class CartTotalsTest(PizzeriaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cart = Cart.objects.create(customer=self.customer)
+
+    def assertCartTotals(self, total_products, final_price):
+        self.cart.refresh_from_db()
+        self.assertEqual(self.cart.total_products, total_products)
+        self.assertEqual(self.cart.final_price, final_price)
+
+    def test_totals_follow_cart_products(self):
+        pepperoni = CartProduct.objects.create(customer=self.customer, cart=self.cart, product=self.pepperoni)
+        CartProduct.objects.create(customer=self.customer, cart=self.cart, product=self.mediterranean, qty=2)
+        self.assertCartTotals(3, Decimal('35.00'))
+
+        pepperoni = CartProduct.objects.get(pk=pepperoni.pk)
+        pepperoni.qty = 3
+        pepperoni.save()
+        self.assertCartTotals(5, Decimal('55.00'))
+
+        pepperoni.delete()
+        self.assertCartTotals(2, Decimal('25.00'))
+
+    def test_stale_instance_does_not_drift_totals(self):
+        CartProduct.objects.create(customer=self.customer, cart=self.cart, product=self.pepperoni)
+        stale = CartProduct.objects.get(cart=self.cart)
+        CartProduct.objects.add_product(self.cart, self.pepperoni)
+        stale.qty = 5
+        stale.save()
+        self.assertCartTotals(5, Decimal('50.00'))
+
+        deferred = CartProduct.objects.defer('qty', 'final_price').get(cart=self.cart)
+        deferred.delete()
+        self.assertCartTotals(0, Decimal('0.00'))
+
+    def test_cascade_and_queryset_deletes_update_totals(self):
+        CartProduct.objects.create(customer=self.customer, cart=self.cart, product=self.pepperoni)
+        CartProduct.objects.create(customer=self.customer, cart=self.cart, product=self.mediterranean, qty=2)
+        Pizza.objects.get(pk=self.pepperoni.pk).delete()
+        self.assertCartTotals(2, Decimal('25.00'))
+
+        CartProduct.objects.filter(cart=self.cart).delete()
+        self.assertCartTotals(0, Decimal('0.00'))
+
+    def test_reconcile_cart_totals(self):
+        CartProduct.objects.create(customer=self.customer, cart=self.cart, product=self.pepperoni, qty=2)
+        Cart.objects.filter(pk=self.cart.pk).update(total_products=7, final_price=1)
+        self.assertEqual(list(Cart.objects.get_carts_with_wrong_totals()), [self.cart])
+
+        call_command('reconcile_cart_totals', stdout=StringIO())
+        self.assertCartTotals(2, Decimal('20.00'))
+        self.assertFalse(Cart.objects.get_carts_with_wrong_totals().exists())
+
+
+class AddToCartTest(PizzeriaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cart = Cart.objects.create(customer=self.customer)
+
+    def assertCartContents(self, qty, final_price):
+        cart_product = CartProduct.objects.get(cart=self.cart, product=self.pepperoni)
+        self.assertEqual((cart_product.qty, cart_product.final_price), (qty, final_price))
+        cart = Cart.objects.get(pk=self.cart.pk)
+        self.assertEqual((cart.total_products, cart.final_price), (qty, final_price))
+
+    def test_upsert(self):
+        for _ in range(2):
+            with self.assertNumQueries(2):
+                CartProduct.objects.add_product(self.cart, self.pepperoni)
+        self.assertCartContents(2, Decimal('20.00'))
+
+    @mock.patch('pizzeria.managers.CartProductManager._supports_upsert', return_value=False)
+    def test_update_or_insert(self, supports_upsert):
+        for _ in range(2):
+            CartProduct.objects.add_product(self.cart, self.pepperoni)
+        self.assertCartContents(2, Decimal('20.00'))
+
+    @mock.patch('pizzeria.managers.CartProductManager._supports_upsert', return_value=False)
+    def test_insert_race(self, supports_upsert):
+        # The product is added by someone else between the update which found nothing and the insert
+        CartProduct.objects.create(customer=self.customer, cart=self.cart, product=self.pepperoni)
+        increments = [lambda *args: None, CartProduct.objects._increment]
+        with mock.patch.object(CartProduct.objects, '_increment', side_effect=lambda *args: increments.pop(0)(*args)):
+            CartProduct.objects.add_product(self.cart, self.pepperoni)
+        self.assertCartContents(2, Decimal('20.00'))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, IMAGE_PROCESSING_ASYNC=False)
+@skipUnlessDBFeature('test_db_allows_multiple_connections')
+class AddToCartConcurrencyTest(TransactionTestCase):
+    threads = 20
+
+    def setUp(self):
+        user = User.objects.create_user(username='john', password='password')
+        customer = Customer.objects.create(user=user, phone_number='380123456789', address='Main st.')
+        category = Category.objects.create(name='Meat', slug='meat')
+        self.pizza = Pizza.objects.create(name='Pepperoni', slug='pepperoni', price=Decimal('10.00'),
+                                          category=category, image=make_image(), description='Pepperoni')
+        self.cart = Cart.objects.create(customer=customer)
+
+    def add_concurrently(self):
+        barrier = threading.Barrier(self.threads)
+        errors = []
+
+        def add_product():
+            barrier.wait()
+            try:
+                CartProduct.objects.add_product(self.cart, self.pizza)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=add_product) for _ in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        cart_product = CartProduct.objects.get()
+        self.assertEqual((cart_product.qty, cart_product.final_price), (self.threads, self.threads * self.pizza.price))
+        cart = Cart.objects.get()
+        self.assertEqual((cart.total_products, cart.final_price), (self.threads, self.threads * self.pizza.price))
+
+    def test_upsert(self):
+        self.add_concurrently()
+
+    @mock.patch('pizzeria.managers.CartProductManager._supports_upsert', return_value=False)
+    def test_update_or_insert(self, supports_upsert):
+        self.add_concurrently()
+
+
+class CartResolutionTest(PizzeriaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def test_read_only_pages_do_not_create_cart(self):
+        for url in ['/', '/cart/', '/pizzas/pepperoni/', '/category/meat/']:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertFalse(Cart.objects.exists())
+
+    def test_add_to_cart_creates_cart(self):
+        self.client.get('/add-to-cart/pepperoni/')
+        self.client.get('/add-to-cart/pepperoni/')
+        cart = Cart.objects.get(customer=self.customer, in_order=False)
+        self.assertEqual(cart.total_products, 2)
+        self.assertEqual(cart.final_price, Decimal('20.00'))
+
+
+class CheckoutTest(PizzeriaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+        self.cart = Cart.objects.create(customer=self.customer)
+        for product in (self.pepperoni, self.mediterranean):
+            CartProduct.objects.create(customer=self.customer, cart=self.cart, product=product)
+        self.order_data = dict(first_name='John', last_name='Doe', phone='380123456789', address='Main street',
+                               delivery=Order.DELIVERY_OFF,
+                               order_date_time=(datetime.now() + timedelta(hours=2)).strftime('%Y-%m-%d %H:%M'))
+
+    def test_checkout_snapshots_totals(self):
+        response = self.client.post('/finish-order/', self.order_data)
+        self.assertRedirects(response, '/', fetch_redirect_response=False)
+        order = Order.objects.get()
+        self.assertEqual((order.cart, order.total_products, order.final_price), (self.cart, 2, Decimal('22.50')))
+        self.assertEqual(list(order.items.order_by('id').values_list('name', 'category', 'price', 'qty')), [
+            ('Pepperoni', 'Meat', Decimal('10.00'), 1), ('Mediterranean', 'Meat', Decimal('12.50'), 1)
+        ])
+        self.assertTrue(Cart.objects.get(pk=self.cart.pk).in_order)
+        self.assertEqual(list(self.customer.orders.all()), [order])
+
+    def test_totals_are_counted_from_ordered_products(self):
+        Cart.objects.filter(pk=self.cart.pk).update(total_products=5, final_price=Decimal('99.00'))
+        self.client.post('/finish-order/', self.order_data)
+        order = Order.objects.get()
+        self.assertEqual((order.total_products, order.final_price), (2, Decimal('22.50')))
+
+    def test_order_keeps_its_items(self):
+        self.client.post('/finish-order/', self.order_data)
+        Pizza.objects.filter(pk=self.pepperoni.pk).update(name='Pepperoni XL', price=Decimal('15.00'))
+        response = self.client.get(Order.objects.get().get_absolute_url())
+        self.assertContains(response, 'Pepperoni')
+        self.assertNotContains(response, 'Pepperoni XL')
+
+    def test_double_submit_makes_one_order(self):
+        self.client.post('/finish-order/', self.order_data)
+        response = self.client.post('/finish-order/', self.order_data)
+        self.assertRedirects(response, '/cart/', fetch_redirect_response=False)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_empty_cart(self):
+        for cart_product in CartProduct.objects.filter(cart=self.cart):
+            cart_product.delete()
+        response = self.client.post('/finish-order/', self.order_data)
+        self.assertRedirects(response, '/cart/', fetch_redirect_response=False)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(Cart.objects.get(pk=self.cart.pk).in_order)
+
+
+class IdempotencyTest(PizzeriaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def test_add_to_cart_retry_is_replayed(self):
+        for _ in range(2):
+            response = self.client.get('/add-to-cart/pepperoni/', {'idempotency_key': 'first'})
+            self.assertRedirects(response, '/cart/', fetch_redirect_response=False)
+        self.assertEqual(CartProduct.objects.get().qty, 1)
+        self.client.get('/add-to-cart/pepperoni/', HTTP_IDEMPOTENCY_KEY='second')
+        self.assertEqual(CartProduct.objects.get().qty, 2)
+
+    def test_key_is_scoped_to_url(self):
+        self.client.get('/add-to-cart/pepperoni/', {'idempotency_key': 'page'})
+        self.client.get('/add-to-cart/mediterranean/', {'idempotency_key': 'page'})
+        self.assertEqual(CartProduct.objects.count(), 2)
+
+    @override_settings(IDEMPOTENCY_WAIT_TIMEOUT=0)
+    def test_request_in_progress(self):
+        request = RequestFactory().get('/add-to-cart/pepperoni/')
+        request.user = self.user
+        claim_idempotency_key(get_idempotency_cache_key(request, 'busy'), get_request_fingerprint(request))
+        response = self.client.get('/add-to-cart/pepperoni/', HTTP_IDEMPOTENCY_KEY='busy')
+        self.assertEqual(response.status_code, 409)
+        # A double submitted page is sent to the cart instead of an error page
+        response = self.client.get('/add-to-cart/pepperoni/', {'idempotency_key': 'busy'})
+        self.assertRedirects(response, '/cart/', fetch_redirect_response=False)
+        self.assertFalse(CartProduct.objects.exists())
+
+    def test_key_reused_with_other_parameters_is_rejected(self):
+        self.client.get('/add-to-cart/pepperoni/')
+        self.client.post('/change-qty/pepperoni/', {'qty': 2, 'idempotency_key': 'page'})
+        response = self.client.post('/change-qty/pepperoni/', {'qty': 3, 'idempotency_key': 'page'})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(CartProduct.objects.get().qty, 2)
+
+    def test_keys_are_kept_in_the_database(self):
+        # So the other server processes see them too
+        self.client.get('/add-to-cart/pepperoni/', HTTP_IDEMPOTENCY_KEY='shared')
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM {settings.CACHES["idempotency"]["LOCATION"]}')
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+
+class SidebarCacheTest(PizzeriaTestCase):
+
+    def test_sidebar_is_cached(self):
+        self.assertEqual([(category, category.count) for category in Category.objects.get_categories_for_sidebar()],
+                         [(self.category, 2)])
+        with self.assertNumQueries(0):
+            Category.objects.get_categories_for_sidebar()
+
+    def test_sidebar_is_invalidated(self):
+        Category.objects.get_categories_for_sidebar()
+        Pizza.objects.get(pk=self.pepperoni.pk).delete()
+        self.assertEqual([category.count for category in Category.objects.get_categories_for_sidebar()], [1])
+        self.create_pizza('Margherita', Decimal('8.00'), [], in_stock=False)
+        self.assertEqual([category.count for category in Category.objects.get_categories_for_sidebar()], [1])
+        self.create_pizza('Marinara', Decimal('8.00'), [])
+        self.assertEqual([category.count for category in Category.objects.get_categories_for_sidebar()], [2])
+
+
+class PizzaFilterTest(PizzeriaTestCase):
+
+    def filter_pizzas(self, data):
+        return set(PizzaFilter(data, queryset=Pizza.objects.filter(in_stock=True)).qs)
+
+    def test_filter_pizzas_with_all_ingredients(self):
+        ingredients = [self.salami.pk, self.olives.pk]
+        with self.assertNumQueries(2):
+            self.assertEqual(self.filter_pizzas({'ingredients': ingredients}), {self.mediterranean})
+        self.assertEqual(self.filter_pizzas({'ingredients': [self.salami.pk]}), {self.pepperoni, self.mediterranean})
+
+    def test_filter_pizzas_with_any_ingredient(self):
+        margherita = self.create_pizza('Margherita', Decimal('8.00'), [])
+        data = {'ingredients': [self.salami.pk, self.olives.pk], 'ingredients_match': 'any'}
+        self.assertEqual(self.filter_pizzas(data), {self.pepperoni, self.mediterranean})
+        self.assertIn(margherita, self.filter_pizzas({}))
+
+
+class MenuSearchTest(PizzeriaTestCase):
+
+    def search(self, query):
+        return list(search_pizzas(Pizza.objects.all(), query))
+
+    def test_search_by_words_and_prefixes(self):
+        self.assertEqual(self.search('olive'), [self.mediterranean])
+        self.assertEqual(self.search('Salami meat'), [self.pepperoni, self.mediterranean])
+        self.assertEqual(self.search('pepperoni olives'), [])
+        self.assertEqual(self.search('   '), [self.pepperoni, self.mediterranean])
+
+    def test_most_relevant_first(self):
+        salami = self.create_pizza('Salami', Decimal('9.00'), [self.salami])
+        salami.description = 'Salami, salami and salami'
+        salami.save()
+        self.assertEqual(self.search('salami')[0], salami)
+
+    def test_documents_follow_menu_changes(self):
+        Ingredient.objects.filter(pk=self.olives.pk).get().delete()
+        self.assertEqual(self.search('olives'), [])
+        salami = Ingredient.objects.get(pk=self.salami.pk)
+        salami.name = 'Chorizo'
+        salami.save()
+        self.assertEqual(self.search('chorizo'), [self.pepperoni, self.mediterranean])
+        self.pepperoni.ingredients.remove(salami)
+        self.assertEqual(self.search('chorizo'), [self.mediterranean])
+        category = Category.objects.get(pk=self.category.pk)
+        category.name = 'Classic'
+        category.save()
+        self.assertEqual(len(self.search('classic')), 2)
+        Pizza.objects.get(pk=self.pepperoni.pk).delete()
+        self.assertEqual(self.search('classic'), [self.mediterranean])
+
+    def test_filter_and_api(self):
+        filtered = PizzaFilter({'q': 'olives', 'price__lt': 20}, queryset=Pizza.objects.filter(in_stock=True)).qs
+        self.assertEqual(list(filtered), [self.mediterranean])
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get('/api/pizzas/', {'q': 'salami'})
+        self.assertEqual([pizza['id'] for pizza in response.data['results']],
+                         [self.pepperoni.pk, self.mediterranean.pk])
+
+    def test_description_cont_searches_like_q(self):
+        queryset = Pizza.objects.all()
+        self.assertEqual(list(PizzaFilter({'description_cont': 'olives'}, queryset=queryset).qs),
+                         list(PizzaFilter({'q': 'olives'}, queryset=queryset).qs))
+
+
+class MenuIndexTest(PizzeriaTestCase):
+
+    def test_filter_ids(self):
+        self.assertEqual(menu_index.filter_ids([self.salami.pk]), sorted([self.pepperoni.pk, self.mediterranean.pk]))
+        self.assertEqual(menu_index.filter_ids([self.salami.pk, self.olives.pk]), [self.mediterranean.pk])
+        self.assertEqual(menu_index.filter_ids([self.salami.pk], price_lt=Decimal('11')), [self.pepperoni.pk])
+        with self.assertNumQueries(0):
+            menu_index.filter_ids([self.olives.pk], match_any=True, category_id=self.category.pk)
+
+    @mock.patch('pizzeria.signals.transaction.on_commit', lambda func: func())
+    def test_index_follows_menu_changes(self):
+        menu_index.filter_ids()
+        margherita = self.create_pizza('Margherita', Decimal('8.00'), [self.olives])
+        mediterranean = Pizza.objects.get(pk=self.mediterranean.pk)
+        mediterranean.in_stock = False
+        mediterranean.save()
+        self.salami.related_pizza.add(margherita)
+        with self.assertNumQueries(0):
+            self.assertEqual(menu_index.filter_ids([self.olives.pk, self.salami.pk]), [margherita.pk])
+        margherita.ingredients.clear()
+        self.assertEqual(menu_index.filter_ids([self.olives.pk]), [])
+
+    def test_change_racing_another_process_rebuilds_index(self):
+        menu_index.filter_ids()
+        with menu_index._change():
+            # Another process changes the menu in between
+            Pizza.objects.filter(pk=self.pepperoni.pk).update(price=Decimal('99.00'))
+            cache.incr(MENU_INDEX_VERSION_KEY)
+        self.assertEqual(menu_index.filter_ids(price_gt=50), [self.pepperoni.pk])
+
+    def test_indexed_filter_matches_database_filter(self):
+        for data in [{'ingredients': [self.salami.pk]}, {'ingredients': [self.salami.pk], 'price__gt': '11'},
+                     {'ingredients': [self.olives.pk, self.salami.pk], 'ingredients_match': 'any'}, {}]:
+            queryset = Pizza.objects.filter(in_stock=True)
+            self.assertEqual(set(IndexedPizzaFilter(data, queryset=queryset).qs),
+                             set(PizzaFilter(data, queryset=queryset).qs))
+
+    @mock.patch.object(IndexedPizzaFilter, 'max_index_ids', 1)
+    def test_many_matching_pizzas_are_filtered_by_database(self):
+        qs = IndexedPizzaFilter({'ingredients': [self.salami.pk]}, queryset=Pizza.objects.filter(in_stock=True)).qs
+        self.assertIn('pizzeria_pizza_ingredients', str(qs.query))
+        self.assertEqual(set(qs), {self.pepperoni, self.mediterranean})
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, IMAGE_PROCESSING_ASYNC=False)
+class MenuIndexTransactionTest(TransactionTestCase):
+
+    def test_rolled_back_changes_are_not_indexed(self):
+        category = Category.objects.create(name='Meat', slug='meat')
+        pizza = Pizza.objects.create(name='Pepperoni', slug='pepperoni', price=Decimal('10.00'), category=category,
+                                     image=make_image(), description='Pepperoni')
+        menu_index.filter_ids()
+        try:
+            with transaction.atomic():
+                pizza.price = Decimal('99.00')
+                pizza.save()
+                raise IntegrityError
+        except IntegrityError:
+            pass
+        self.assertEqual(menu_index.filter_ids(price_gt=50), [])
+        pizza = Pizza.objects.get(pk=pizza.pk)
+        pizza.price = Decimal('99.00')
+        pizza.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(menu_index.filter_ids(price_gt=50), [pizza.pk])
+
+
+class QueryBudgetTest(PizzeriaTestCase):
+    # session + user, customer with the open cart, sidebar
+    base_queries = 4
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+        self.cart = Cart.objects.create(customer=self.customer)
+        CartProduct.objects.create(customer=self.customer, cart=self.cart, product=self.pepperoni)
+
+    def assertQueryBudget(self, url, extra_queries):
+        with self.assertNumQueries(self.base_queries + extra_queries):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_customer_without_open_cart(self):
+        self.cart.delete()
+        # filter form choices, pizzas and a category per pizza, plus a customer lookup since there is no cart
+        self.assertQueryBudget('/', 6)
+
+    def test_base_view(self):
+        # filter form choices, pizzas and a category per pizza
+        self.assertQueryBudget('/', 5)
+
+    def test_cart_view(self):
+        # cart products with their pizzas and categories
+        self.assertQueryBudget('/cart/', 1)
+
+    def test_product_detail_view(self):
+        # pizza with its category, ingredients
+        self.assertQueryBudget('/pizzas/pepperoni/', 2)
+
+    def test_category_detail_view(self):
+        # category, its pizzas
+        self.assertQueryBudget('/category/meat/', 2)
+
+    def test_profile_detail_view(self):
+        self.create_order()
+        # customer, count and a page of customer's orders
+        self.assertQueryBudget(f'/profile/{self.customer.pk}/', 3)
+
+    def test_profile_orders_are_paginated(self):
+        orders = [self.create_order() for _ in range(3)]
+        with mock.patch.object(ProfileDetailView, 'orders_paginate_by', 2):
+            response = self.client.get(f'/profile/{self.customer.pk}/', {'page': 2})
+        self.assertEqual(list(response.context['orders']), orders[:1])
+
+    def test_orders_made_at_the_same_time_are_paginated_once(self):
+        orders = [self.create_order() for _ in range(5)]
+        Order.objects.update(created_at=orders[0].created_at)
+        pages = []
+        with mock.patch.object(ProfileDetailView, 'orders_paginate_by', 2):
+            for page in range(1, 4):
+                response = self.client.get(f'/profile/{self.customer.pk}/', {'page': page})
+                pages.extend(response.context['orders'])
+        self.assertEqual(pages, orders[::-1])
+
+    def test_order_detail_view(self):
+        order = self.create_order()
+        # order with its customer, order items
+        self.assertQueryBudget(f'/order/{order.pk}/', 2)
+
+
+class FragmentCacheTest(PizzeriaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+        Cart.objects.create(customer=self.customer)
+
+    def get_idempotency_keys(self, response):
+        return re.findall(r'idempotency_key=(\w+)', response.content.decode())
+
+    def test_product_grid_is_served_from_cache(self):
+        first = self.client.get('/')
+        # session + user, customer with the open cart, sidebar, filter form choices
+        with self.assertNumQueries(5):
+            second = self.client.get('/')
+        self.assertContains(second, 'Pepperoni')
+        self.assertEqual(get_fragment_cache_stats(), (2, 2))
+        # Add to cart links still get a new idempotency key on every page
+        self.assertNotEqual(self.get_idempotency_keys(first), self.get_idempotency_keys(second))
+        self.assertTrue(all(self.get_idempotency_keys(second)))
+
+    def test_filters_vary_the_grid(self):
+        self.client.get('/', {'price__gt': 11, 'csrfmiddlewaretoken': 'a'})
+        response = self.client.get('/', {'price__gt': 11, 'csrfmiddlewaretoken': 'b'})
+        self.assertNotContains(response, 'Pepperoni')
+        self.assertEqual(get_fragment_cache_stats(), (2, 2))
+        self.assertContains(self.client.get('/'), 'Pepperoni')
+
+    def test_menu_changes_render_the_grid_again(self):
+        self.client.get('/category/meat/')
+        pizza = Pizza.objects.get(pk=self.pepperoni.pk)
+        pizza.in_stock = False
+        pizza.save()
+        self.assertNotContains(self.client.get('/category/meat/'), 'Pepperoni')
+        self.assertNotContains(self.client.get('/'), 'Pepperoni')
+
+    def test_stats_command(self):
+        self.client.get('/')
+        self.client.get('/')
+        out = StringIO()
+        call_command('fragment_cache_stats', '--reset', stdout=out)
+        self.assertIn('Hits: 2, misses: 2, hit rate: 50.0%', out.getvalue())
+        self.assertEqual(get_fragment_cache_stats(), (0, 0))
+
+
+class APIQueryBudgetTest(PizzeriaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for i in range(5):
+            self.create_pizza(f'Pizza {i}', Decimal('9.00'), [self.salami, self.olives])
+        self.cart = Cart.objects.create(customer=self.customer)
+        for pizza in Pizza.objects.all():
+            CartProduct.objects.create(customer=self.customer, cart=self.cart, product=pizza)
+
+    def assertQueryBudget(self, url, queries):
+        with self.assertNumQueries(queries):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_pizzas(self):
+        # count, pizzas with categories, ingredients
+        self.assertQueryBudget('/api/pizzas/', 3)
+        self.assertQueryBudget(f'/api/pizzas/{self.pepperoni.pk}/', 2)
+
+    def test_categories(self):
+        Category.objects.create(name='Veggie', slug='veggie')
+        # count, categories, pizzas
+        self.assertQueryBudget('/api/categories/', 3)
+        self.assertQueryBudget(f'/api/categories/{self.category.slug}/', 2)
+
+    def test_pizzas_cursor_pagination(self):
+        for i in range(5, 15):
+            self.create_pizza(f'Pizza {i}', Decimal('9.00'), [self.salami])
+        # pizzas with categories, ingredients, no count
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/pizzas/', {'pagination': 'cursor'})
+        pizza_ids = [pizza['id'] for pizza in response.data['results']]
+        self.assertNotIn('count', response.data)
+        self.assertIsNone(response.data['previous'])
+        response = self.client.get(response.data['next'])
+        pizza_ids += [pizza['id'] for pizza in response.data['results']]
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(pizza_ids, list(Pizza.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_cart(self):
+        self.assertQueryBudget(f'/api/cart/{self.cart.pk}/', 2)
+        response = self.client.get(f'/api/cart/{self.cart.pk}/')
+        self.assertEqual(len(response.data['products']), Pizza.objects.count())
+
+    def test_customer(self):
+        self.create_order()
+        self.create_order()
+        self.assertQueryBudget(f'/api/customer/{self.customer.pk}/', 2)
+
+    def test_order_history(self):
+        orders = [self.create_order() for _ in range(3)]
+        other_user = User.objects.create_user(username='jane', password='password')
+        Order.objects.create(customer=Customer.objects.create(user=other_user, phone_number='380987654321'),
+                             first_name='Jane', last_name='Doe', phone='380987654321',
+                             order_date_time=datetime.now() + timedelta(hours=2))
+        # a page of orders, their items
+        self.assertQueryBudget('/api/orders/', 2)
+        response = self.client.get('/api/orders/')
+        self.assertEqual([order['id'] for order in response.data['results']], [order.pk for order in reversed(orders)])
+        self.assertEqual(response.data['results'][0]['items'][0]['name'], 'Mediterranean')
+
+
+class CursorPaginationTest(PizzeriaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+
+    def get_all_pages(self, url, params, ordering):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        # The tie-break has to be in the query, the database doesn't have to return tied rows in any order
+        self.assertTrue(any(query['sql'].endswith(ordering) for query in queries), ordering)
+        ids = []
+        while True:
+            ids += [order['id'] for order in response.data['results']]
+            if not response.data['next']:
+                return ids
+            response = self.client.get(response.data['next'])
+
+    @mock.patch.object(OrderHistoryPagination, 'page_size', 2)
+    def test_order_history_with_same_created_at(self):
+        orders = [self.create_order() for _ in range(5)]
+        Order.objects.update(created_at=orders[0].created_at)
+        self.client.force_authenticate(self.user)
+        ids = self.get_all_pages('/api/orders/', {}, 'ORDER BY "pizzeria_order"."created_at" DESC, '
+                                                     '"pizzeria_order"."id" DESC LIMIT 3')
+        self.assertEqual(ids, [order.pk for order in reversed(orders)])
+
+    @mock.patch.object(KitchenQueuePagination, 'page_size', 2)
+    def test_kitchen_queue_with_same_order_date_time(self):
+        orders = [self.create_order() for _ in range(5)]
+        Order.objects.update(order_date_time=orders[0].order_date_time)
+        self.client.force_authenticate(User.objects.create_user(username='cook', is_staff=True))
+        ids = self.get_all_pages('/api/kitchen/orders/', {'status': Order.STATUS_NEW},
+                                 'ORDER BY "pizzeria_order"."order_date_time" ASC, "pizzeria_order"."id" ASC LIMIT 3')
+        self.assertEqual(ids, [order.pk for order in orders])
+
+
+class MenuConditionalGetTest(PizzeriaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_unchanged_menu_is_not_modified(self):
+        for url in ['/api/pizzas/', f'/api/pizzas/{self.pepperoni.pk}/', '/api/categories/']:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            with self.assertNumQueries(0):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+
+    def test_changed_menu_is_sent_again(self):
+        etag = self.client.get('/api/pizzas/')['ETag']
+        self.salami.related_pizza.remove(self.pepperoni)
+        response = self.client.get('/api/pizzas/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_changes_within_a_second_are_sent_again(self):
+        last_modified = self.client.get('/api/pizzas/')['Last-Modified']
+        self.salami.related_pizza.remove(self.pepperoni)
+        last_modified = self.client.get('/api/pizzas/')['Last-Modified']
+        self.salami.related_pizza.add(self.pepperoni)
+        response = self.client.get('/api/pizzas/', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+
+    def test_menu_version_of_a_local_cache_expires(self):
+        with mock.patch('pizzeria.menu_version.cache.set') as cache_set:
+            bump_menu_version()
+        self.assertEqual(cache_set.call_args[0][2], settings.MENU_VERSION_LOCAL_TIMEOUT)
+
+
+class ImageProcessingTest(PizzeriaTestCase):
+
+    def create_margherita(self, slug='margherita'):
+        pizza = Pizza.objects.create(name=slug, slug=slug, price=Decimal('8.00'), category=self.category,
+                                     image=make_image('margherita.jpg', (1000, 800)), description='Margherita')
+        pizza.refresh_from_db()
+        return pizza
+
+    def test_new_image_is_resized(self):
+        pizza = self.create_margherita()
+        with Image.open(pizza.image) as image:
+            self.assertEqual(image.size, (pizza.new_image_width, pizza.new_image_height))
+
+    def test_image_variants(self):
+        pizza = self.create_margherita()
+        self.assertTrue(pizza.image.name.startswith(f'images/pizza/{pizza.image_hash}/'))
+        for variant, width in pizza.image_variants.items():
+            for extension in ['.jpg', '.webp']:
+                with Image.open(f'{MEDIA_ROOT}/images/pizza/{pizza.image_hash}/{variant}{extension}') as image:
+                    self.assertEqual(image.width, width)
+        self.assertEqual(pizza.get_srcset().count('w, '), len(pizza.image_variants) - 1)
+        self.assertIn('image/webp', pizza.get_image())
+
+    def test_identical_images_are_deduplicated(self):
+        first, second = self.create_margherita(), self.create_margherita('marinara')
+        self.assertEqual(first.image.name, second.image.name)
+
+    def test_decompression_bomb_is_rejected(self):
+        file_stream = BytesIO()
+        Image.new('1', (10000, 10000)).save(file_stream, 'PNG')
+        bomb = SimpleUploadedFile('bomb.png', file_stream.getvalue(), content_type='image/png')
+        with warnings.catch_warnings():
+            # Pillow warns about the bomb itself when the header is read
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            with self.assertRaisesMessage(Exception, 'resolution could not be bigger'):
+                Pizza.objects.create(name='Bomb', slug='bomb', price=Decimal('8.00'), category=self.category,
+                                     image=bomb, description='Bomb')
+        self.assertFalse(Pizza.objects.filter(slug='bomb').exists())
+
+    def test_unchanged_image_is_not_processed(self):
+        pizza = Pizza.objects.get(pk=self.pepperoni.pk)
+        pizza.price = Decimal('11.00')
+        with mock.patch('pizzeria.utils.Image.open') as image_open:
+            pizza.save()
+        image_open.assert_not_called()
+
+
+class MenuImportTest(PizzeriaTestCase):
+    menu = 'name,slug,price,category,ingredients,description,in_stock,image\n' \
+           'Diablo,diablo,11.50,Meat,"Salami, Olives",Hot,true,diablo.jpg\n' \
+           'Marinara,marinara,7.00,Meat,,Simple,false,marinara.jpg\n'
+
+    def test_import_menu_command(self):
+        with tempfile.TemporaryDirectory() as menu_dir:
+            with open(f'{menu_dir}/menu.csv', 'w') as menu_file:
+                menu_file.write(self.menu)
+            for name in ['diablo.jpg', 'marinara.jpg']:
+                with open(f'{menu_dir}/{name}', 'wb') as image_file:
+                    image_file.write(make_image(name).read())
+            call_command('import_menu', f'{menu_dir}/menu.csv', stdout=StringIO())
+        diablo = Pizza.objects.get(slug='diablo')
+        self.assertEqual(set(diablo.ingredients.all()), {self.salami, self.olives})
+        self.assertTrue(diablo.image_hash)
+        self.assertFalse(Pizza.objects.get(slug='marinara').in_stock)
+
+    def test_import_menu_api(self):
+        admin = User.objects.create_superuser(username='admin', password='password', email='admin@pizza.com')
+        client = APIClient()
+        client.force_authenticate(admin)
+        menu = SimpleUploadedFile('menu.csv', self.menu.encode())
+        response = client.post('/api/pizzas/import/', {
+            'file': menu, 'diablo.jpg': make_image('diablo.jpg'), 'marinara.jpg': make_image('marinara.jpg')
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Pizza.objects.filter(slug__in=['diablo', 'marinara']).count(), 2)
+
+    def test_invalid_menu_is_not_imported(self):
+        with self.assertRaises(MenuImportError) as cm:
+            import_menu([
+                {'name': 'Diablo', 'slug': 'diablo', 'price': '11.50', 'category': 'Meat', 'ingredients': 'Salami',
+                 'description': 'Hot', 'image': 'diablo.jpg'},
+                {'name': 'Veggie', 'slug': 'veggie', 'price': '9.00', 'category': 'Veggie', 'ingredients': 'Tofu',
+                 'description': 'Veggie', 'image': 'veggie.jpg'},
+            ], {'diablo.jpg': make_image('diablo.jpg')}.get)
+        self.assertEqual(cm.exception.errors, ['Row 2: unknown category "Veggie"; unknown ingredients Tofu; '
+                                               'no image "veggie.jpg"'])
+        self.assertFalse(Pizza.objects.filter(slug='diablo').exists())
+
+    def test_duplicate_names_and_invalid_prices_are_reported(self):
+        row = {'name': 'Diablo', 'slug': 'diablo', 'price': '11.50', 'category': 'Meat', 'ingredients': 'Salami',
+               'description': 'Hot', 'image': 'pizza.jpg'}
+        with self.assertRaises(MenuImportError) as cm:
+            import_menu([row, dict(row, slug='diablo-2', price='cheap'),
+                         dict(row, name='Pepperoni', slug='pepperoni-2')], lambda name: make_image(name))
+        self.assertEqual(cm.exception.errors, [
+            'Row 2: pizza named "Diablo" already exists; price “cheap” value must be a decimal number.',
+            'Row 3: pizza named "Pepperoni" already exists',
+        ])
+
+    def test_undecodable_menu_is_reported(self):
+        with self.assertRaisesMessage(MenuImportError, 'Line 2: invalid JSON'):
+            read_menu_rows(StringIO('{"name": "Diablo"}\n{"name": \n'), 'jsonl')
+        admin = User.objects.create_superuser(username='admin', password='password', email='admin@pizza.com')
+        client = APIClient()
+        client.force_authenticate(admin)
+        menu = SimpleUploadedFile('menu.csv', 'Diablo'.encode('utf-16'))
+        response = client.post('/api/pizzas/import/', {'file': menu})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['errors'], ['The menu file is not UTF-8 text'])
+
+
+class ExplainQueriesTest(PizzeriaTestCase):
+
+    def test_hot_queries_use_indexes(self):
+        out = StringIO()
+        call_command('explain_queries', stdout=out)
+        for index in ['cart_open_customer_idx', 'pizza_category_in_stock_idx', 'pizza_in_stock_price_idx',
+                      'order_customer_created_idx', 'order_customer_status_idx', 'order_status_date_time_idx']:
+            self.assertIn(index, out.getvalue())
+
+    def test_full_scan_is_reported(self):
+        queries = [('pizzas by description', Pizza.objects.filter(description='Pepperoni'))]
+        with mock.patch('pizzeria.management.commands.explain_queries.Command.get_queries', return_value=queries):
+            with self.assertRaisesMessage(CommandError, 'pizzas by description'):
+                call_command('explain_queries', stdout=StringIO())
+
+
+class ASGIHandlerTest(SimpleTestCase):
+
+    def test_requests_are_handled_concurrently(self):
+        # Both requests have to be in the view at the same time to get through the barrier
+        barrier = threading.Barrier(2, timeout=5)
+
+        def get_response(handler, request):
+            barrier.wait()
+            return HttpResponse()
+
+        async def send_request():
+            messages = []
+
+            async def receive():
+                return {'type': 'http.request', 'body': b''}
+
+            async def send(message):
+                messages.append(message)
+
+            scope = {'type': 'http', 'method': 'GET', 'path': '/', 'headers': [(b'host', b'testserver')]}
+            await ASGIHandler()(scope, receive, send)
+            return messages[0]['status']
+
+        async def send_requests():
+            return await asyncio.gather(send_request(), send_request())
+
+        with mock.patch.object(ASGIHandler, 'get_response', get_response):
+            self.assertEqual(asyncio.run(send_requests()), [200, 200])
+
+
+@mock.patch('pizzeria.order_events.transaction.on_commit', lambda func: func())
+class OrderEventsTest(PizzeriaTestCase):
+
+    def test_status_changes_are_published(self):
+        order = self.create_order()
+        order = Order.objects.get(pk=order.pk)
+        with mock.patch('pizzeria.order_events.get_broker') as get_broker:
+            order.comment = 'Ring twice'
+            order.save()
+            order.status = Order.STATUS_READY
+            order.save()
+            order.save()
+        get_broker.return_value.publish.assert_called_once_with(
+            order.pk, {'id': order.pk, 'status': Order.STATUS_READY}
+        )
+
+    @mock.patch('pizzeria.order_stream.close_old_connections')
+    def test_stream_is_only_for_the_customer_and_the_kitchen(self, close_old_connections):
+        order = self.create_order()
+        other_user = User.objects.create_user(username='jane', password='password')
+        kitchen_user = User.objects.create_user(username='kitchen', password='password', is_staff=True)
+        token = Token.objects.create(user=other_user)
+
+        def get_status(headers):
+            return get_stream_order_status({'type': 'http', 'method': 'GET', 'path': '/', 'headers': headers},
+                                           order.pk)
+
+        def session_cookie(user):
+            self.client.force_login(user)
+            return [(b'cookie', f'sessionid={self.client.cookies["sessionid"].value}'.encode())]
+
+        self.assertEqual(get_status([]), (403, None))
+        self.assertEqual(get_status(session_cookie(self.user)), (200, Order.STATUS_NEW))
+        self.assertEqual(get_status(session_cookie(kitchen_user)), (200, Order.STATUS_NEW))
+        self.assertEqual(get_status([(b'authorization', f'Token {token.key}'.encode())]), (404, None))
+
+
+class OrderStreamTest(SimpleTestCase):
+
+    def test_status_changes_are_streamed_until_completed(self):
+        broker = InProcessBroker()
+        messages = []
+
+        async def receive():
+            if not messages:
+                return {'type': 'http.request', 'body': b''}
+            await asyncio.Event().wait()
+
+        async def stream():
+            first_event = asyncio.Event()
+
+            async def send(message):
+                messages.append(message)
+                first_event.set()
+
+            scope = {'type': 'http', 'method': 'GET', 'path': '/api/order/1/events/', 'headers': []}
+            task = asyncio.ensure_future(ASGIHandler()(scope, receive, send))
+            await first_event.wait()
+            # Published from another thread, like the views do
+            for status in [Order.STATUS_IN_PROGRESS, Order.STATUS_IN_PROGRESS, Order.STATUS_COMPLETED]:
+                await asyncio.get_running_loop().run_in_executor(None, broker.publish, 1,
+                                                                 {'id': 1, 'status': status})
+            await asyncio.wait_for(task, 5)
+
+        with mock.patch('pizzeria.order_stream.get_broker', return_value=broker), \
+                mock.patch('pizzeria.order_stream.get_stream_order_status', lambda scope, order_id: (200, 'new')):
+            asyncio.run(stream())
+        self.assertEqual(messages[0]['status'], 200)
+        self.assertEqual(b''.join(message.get('body', b'') for message in messages[1:]), b''.join(
+            format_event({'id': 1, 'status': status}) for status in ['new', 'in progress', 'completed']
+        ))
+        self.assertFalse(broker._subscribers)
+
+
+@mock.patch('pizzeria.order_events.transaction.on_commit', lambda func: func())
+class KitchenTest(PizzeriaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cook = User.objects.create_user(username='cook', password='password', is_staff=True)
+        Customer.objects.create(user=self.cook, phone_number='380987654321', address='Kitchen')
+        self.first, self.second = self.create_order(), self.create_order()
+        Order.objects.filter(pk=self.first.pk).update(order_date_time=datetime.now() + timedelta(hours=3))
+
+    def move(self, status, orders):
+        client = APIClient()
+        client.force_authenticate(self.cook)
+        return client.post('/api/kitchen/orders/status/', {
+            'status': status, 'orders': [{'id': order.pk, 'version': version} for order, version in orders]
+        }, format='json')
+
+    def test_queue_is_ordered_by_date_time(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.get('/api/kitchen/orders/').status_code, 403)
+        client.force_authenticate(self.cook)
+        response = client.get('/api/kitchen/orders/', {'status': Order.STATUS_NEW})
+        self.assertEqual([order['id'] for order in response.data['results']], [self.second.pk, self.first.pk])
+        self.assertEqual(response.data['results'][0]['items'], [{'name': 'Mediterranean', 'qty': 1}])
+
+    def test_orders_are_moved_with_one_update(self):
+        with mock.patch('pizzeria.order_events.get_broker') as get_broker, \
+                CaptureQueriesContext(connection) as queries:
+            response = self.move(Order.STATUS_IN_PROGRESS, [(self.first, 0), (self.second, 0)])
+        self.assertEqual(response.status_code, 200)
+        self.assertCountEqual(response.data['moved'], [{'id': self.first.pk, 'version': 1},
+                                                       {'id': self.second.pk, 'version': 1}])
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE')]), 1)
+        self.assertEqual(get_broker.return_value.publish.call_count, 2)
+        self.assertEqual(Order.objects.filter(status=Order.STATUS_IN_PROGRESS).count(), 2)
+
+    def test_stale_versions_are_not_moved(self):
+        self.move(Order.STATUS_IN_PROGRESS, [(self.first, 0)])
+        # The second cook still sees the first order as new
+        response = self.move(Order.STATUS_IN_PROGRESS, [(self.first, 0), (self.second, 0)])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['moved'], [{'id': self.second.pk, 'version': 1}])
+        self.assertEqual(response.data['conflicts'], [
+            {'id': self.first.pk, 'status': Order.STATUS_IN_PROGRESS, 'version': 1}
+        ])
+        response = self.move(Order.STATUS_COMPLETED, [(self.first, 1)])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Order.objects.get(pk=self.first.pk).status, Order.STATUS_IN_PROGRESS)
+
+    def test_saving_a_new_status_changes_the_version(self):
+        order = Order.objects.get(pk=self.first.pk)
+        order.comment = 'No onions'
+        order.save()
+        order.status = Order.STATUS_IN_PROGRESS
+        order.save()
+        self.assertEqual(Order.objects.get(pk=self.first.pk).version, 1)
+        # The model keeps its version right without the signal receiver
+        post_save.disconnect(publish_order_status_change, sender=Order)
+        try:
+            order.save()
+        finally:
+            post_save.connect(publish_order_status_change, sender=Order)
+        self.assertEqual(Order.objects.get(pk=self.first.pk).version, 1)
+
+    @mock.patch('pizzeria.signals.publish_order_status')
+    def test_order_loaded_without_status(self, publish_order_status):
+        order = Order.objects.only('comment').get(pk=self.first.pk)
+        order.comment = 'No onions'
+        order.save()
+        self.assertEqual(Order.objects.get(pk=self.first.pk).version, 0)
+        publish_order_status.assert_not_called()
+
+        order = Order.objects.only('comment').get(pk=self.first.pk)
+        order.status = Order.STATUS_IN_PROGRESS
+        order.save()
+        self.assertEqual(Order.objects.get(pk=self.first.pk).version, 1)
+        publish_order_status.assert_called_once_with(self.first.pk, Order.STATUS_IN_PROGRESS)
+
+    def test_kitchen_screen(self):
+        self.client.login(username='john', password='password')
+        self.assertEqual(self.client.get('/kitchen/').status_code, 403)
+        self.client.login(username='cook', password='password')
+        response = self.client.get('/kitchen/')
+        self.assertContains(response, f'value="{self.first.pk}:0"')
+        response = self.client.post('/kitchen/', {'status': Order.STATUS_IN_PROGRESS,
+                                                  'orders': [f'{self.first.pk}:0', f'{self.second.pk}:3']})
+        self.assertRedirects(response, '/kitchen/')
+        self.assertEqual(Order.objects.get(pk=self.first.pk).status, Order.STATUS_IN_PROGRESS)
+        self.assertEqual(Order.objects.get(pk=self.second.pk).status, Order.STATUS_NEW)
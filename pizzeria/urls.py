@@ -2,7 +2,7 @@ from django.urls import path
 
 from .views import BaseView, ProductDetailView, CategoryDetailView, \
     CartView, AddProductToCartView, DeleteFromCartView, ChangeQtyView, FinishOrderView, \
-    registration, login_view, logout_view, ProfileDetailView, OrderDetailView
+    registration, login_view, logout_view, ProfileDetailView, OrderDetailView, KitchenView
 
 urlpatterns = [
     path('', BaseView.as_view(), name='base'),
@@ -18,4 +18,5 @@ urlpatterns = [
     path('logout/', logout_view, name='logout'),
     path('profile/<int:pk>/', ProfileDetailView.as_view(), name='profile'),
     path('order/<int:pk>/', OrderDetailView.as_view(), name='order_view'),
+    path('kitchen/', KitchenView.as_view(), name='kitchen'),
 ]
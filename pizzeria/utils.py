@@ -1,29 +1,157 @@
-import sys
-from io import BytesIO
+import hashlib
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 
 from PIL import Image
-from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction, connection
 from django.utils.safestring import mark_safe
 
+from .menu_version import bump_menu_version
+
+logger = logging.getLogger(__name__)
+
+IMAGE_VARIANT_FORMATS = (
+    ('.jpg', 'JPEG', 85),
+    ('.webp', 'WEBP', 80)
+)
+
+image_executor = ThreadPoolExecutor(max_workers=settings.IMAGE_PROCESSING_WORKERS,
+                                    thread_name_prefix='image-processing')
+
 
 def get_image(obj, width, height):
-    return mark_safe(f'<img src={obj.image.url} width="{width}" height="{height}"')
+    if not obj.image_hash:
+        return mark_safe(f'<img src="{obj.image.url}" width="{width}" height="{height}">')
+    return mark_safe(
+        f'<picture><source type="image/webp" srcset="{get_srcset(obj, ".webp")}" sizes="{width}px">'
+        f'<img src="{obj.image.url}" srcset="{get_srcset(obj, ".jpg")}" sizes="{width}px" '
+        f'width="{width}" height="{height}"></picture>'
+    )
 
 
-def change_image_resolution(image, min_resolution, max_resolution, max_image_size, new_image_width, new_image_height):
-    img = Image.open(image)
-    min_height, min_width = min_resolution
-    max_height, max_width = max_resolution
+def validate_image(image, max_image_size, max_image_pixels):
     if image.size > max_image_size:
         raise Exception(f'Uploaded images\'s size could not be bigger than {max_image_size}')
-    if img.height < min_height or img.width < min_width or img.height > max_height or img.width > max_width:
-        new_img = img.convert('RGB')
-        resized_new_image = new_img.resize((new_image_width, new_image_height), Image.ANTIALIAS)
-        file_stream = BytesIO()
-        resized_new_image.save(file_stream, 'JPEG', quality=90)
-        file_stream.seek(0)
-        name = image.name
-        image = InMemoryUploadedFile(
-            file_stream, 'ImageField', name, 'jpeg/image', sys.getsizeof(file_stream), None
-        )
+    # Only the header is read here, so decompression bombs are rejected before any pixel is decoded
+    with Image.open(image) as img:
+        width, height = img.size
+    image.seek(0)
+    if width * height > max_image_pixels:
+        raise Exception(f'Uploaded images\'s resolution could not be bigger than {max_image_pixels} pixels')
+
+
+def save_to_temp_file(img, name, image_format, **options):
+    temp_file = tempfile.TemporaryFile()
+    img.save(temp_file, image_format, **options)
+    temp_file.seek(0)
+    return File(temp_file, name=name)
+
+
+def change_image_resolution(image, min_resolution, max_resolution, max_image_size, max_image_pixels,
+                            new_image_width, new_image_height):
+    validate_image(image, max_image_size, max_image_pixels)
+    min_height, min_width = min_resolution
+    max_height, max_width = max_resolution
+    with Image.open(image) as img:
+        if img.height < min_height or img.width < min_width or img.height > max_height or img.width > max_width:
+            # JPEGs are decoded right at a reduced scale, not smaller than the needed resolution
+            img.draft('RGB', (new_image_width, new_image_height))
+            new_img = img.convert('RGB')
+            resized_new_image = new_img.resize((new_image_width, new_image_height), Image.ANTIALIAS)
+            image = save_to_temp_file(resized_new_image, image.name, 'JPEG', quality=90)
     return image
+
+
+def has_new_image(obj):
+    # Images loaded from the database are committed, only a new upload needs processing
+    return bool(obj.image) and not obj.image._committed
+
+
+def schedule_image_processing(obj):
+    args = (type(obj), obj.pk, obj.image.name)
+    if settings.IMAGE_PROCESSING_ASYNC:
+        transaction.on_commit(lambda: image_executor.submit(process_stored_image, *args))
+    else:
+        process_stored_image(*args)
+
+
+def process_stored_image(model, pk, name):
+    try:
+        obj = model.objects.filter(pk=pk, image=name).first()
+        if not obj:
+            # Deleted or got another image in the meantime
+            return
+        storage = obj.image.storage
+        image_hash = get_file_hash(obj.image)
+        processed_name = model.objects.filter(image_hash=image_hash).exclude(image=name).values_list(
+            'image', flat=True
+        ).first()
+        if processed_name:
+            # The same file was uploaded before, its image and variants are reused
+            new_name = processed_name
+        else:
+            obj.image.seek(0)
+            image = change_image_resolution(image=obj.image,
+                                            min_resolution=obj.min_resolution,
+                                            max_resolution=obj.max_resolution,
+                                            max_image_size=obj.max_image_size,
+                                            max_image_pixels=obj.max_image_pixels,
+                                            new_image_width=obj.new_image_width,
+                                            new_image_height=obj.new_image_height)
+            extension = '.jpg' if image is not obj.image else os.path.splitext(name)[1]
+            new_name = get_image_variant_name(obj, image_hash, 'image', extension)
+            if not storage.exists(new_name):
+                new_name = storage.save(new_name, image)
+            if image is not obj.image:
+                image.close()
+            with storage.open(new_name) as image_file:
+                save_image_variants(obj, storage, image_hash, image_file)
+        obj.image.close()
+        # update() doesn't send signals or call save(), so the processed image isn't processed again
+        if model.objects.filter(pk=pk, image=name).update(image=new_name, image_hash=image_hash):
+            storage.delete(name)
+            bump_menu_version()
+    except Exception:
+        logger.exception('Could not process the image %s of %s %s', name, model.__name__, pk)
+        if not settings.IMAGE_PROCESSING_ASYNC:
+            raise
+    finally:
+        if settings.IMAGE_PROCESSING_ASYNC:
+            connection.close()
+
+
+def get_file_hash(file):
+    sha256 = hashlib.sha256()
+    for chunk in file.chunks():
+        sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def get_image_variant_name(obj, image_hash, variant, extension):
+    # Content addressed, so the files never change and can be cached forever
+    return f'images/{obj._meta.model_name}/{image_hash}/{variant}{extension}'
+
+
+def save_image_variants(obj, storage, image_hash, image_file):
+    with Image.open(image_file) as img:
+        img = img.convert('RGB')
+        for variant, width in obj.image_variants.items():
+            resized_img = img.resize((width, round(width * img.height / img.width)), Image.ANTIALIAS)
+            for extension, image_format, quality in IMAGE_VARIANT_FORMATS:
+                name = get_image_variant_name(obj, image_hash, variant, extension)
+                if not storage.exists(name):
+                    with save_to_temp_file(resized_img, name, image_format, quality=quality) as variant_file:
+                        storage.save(name, variant_file)
+
+
+def get_srcset(obj, extension):
+    if not obj.image_hash:
+        return ''
+    return ', '.join(
+        f'{obj.image.storage.url(get_image_variant_name(obj, obj.image_hash, variant, extension))} {width}w'
+        for variant, width in obj.image_variants.items()
+    )
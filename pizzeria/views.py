@@ -1,22 +1,27 @@
 from datetime import timedelta
 
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
-from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.core.paginator import Paginator
 from django.db import transaction
 from django.db.utils import IntegrityError
 from django.shortcuts import render, redirect
 from django.urls import reverse
+from django.utils.http import urlencode
 from django.utils import timezone
 from django.views.generic import DetailView, CreateView
 from django.views.generic.base import View
 from rest_framework.authtoken.models import Token
 
-from .filters import PizzaFilter
+from .checkout import place_order, CheckoutError
+from .filters import PizzaFilter, IndexedPizzaFilter
 from .forms import OrderForm, CreateUserForm
-from .mixins import CategoryMixin, CartMixin, CustomerMixin
-from .models import Customer, Pizza, Category, Ingredient, Order, CartProduct
+from .kitchen import KITCHEN_STATUSES, get_kitchen_queue, move_orders, KitchenError
+from .mixins import CategoryMixin, CartMixin, CustomerMixin, IdempotentMixin
+from .models import Customer, Pizza, Category, Order, CartProduct
 
 
 @transaction.atomic()
@@ -75,26 +80,30 @@ class BaseView(LoginRequiredMixin, CartMixin, View):
     login_url = 'login'
 
     def get(self, request, *args, **kwargs):
-        customer = Customer.objects.get(user=request.user)
-        f = PizzaFilter(request.GET, queryset=Pizza.objects.filter(in_stock=True))
+        filter_class = IndexedPizzaFilter if settings.MENU_INDEX_ENABLED else PizzaFilter
+        f = filter_class(request.GET, queryset=Pizza.objects.filter(in_stock=True))
         context = {
             'categories': Category.objects.get_categories_for_sidebar(),
             'cart': self.cart,
-            'customer': customer,
-            'filter': f
+            'customer': request.customer_cart.customer,
+            'filter': f,
+            # The product grid is cached for every combination of the filters
+            'filter_key': urlencode(sorted(
+                (name, value) for name in f.filters for value in request.GET.getlist(name) if value
+            ))
         }
         return render(request, 'base.html', context)
 
 
 class ProductDetailView(CustomerMixin, CartMixin, CategoryMixin, DetailView):
     model = Pizza
+    queryset = Pizza.objects.select_related('category')
     context_object_name = 'product'
     template_name = 'product_detail.html'
 
     def get_context_data(self, **kwargs):
-        ingredients = Ingredient.objects.filter(related_pizza__slug=self.kwargs.get('slug'))
         context = super().get_context_data(**kwargs)
-        context['ingredients'] = ingredients
+        context['ingredients'] = self.object.ingredients.all()
         return context
 
 
@@ -103,11 +112,12 @@ class ProfileDetailView(CustomerMixin, LoginRequiredMixin, CartMixin, CategoryMi
     model = Customer
     context_object_name = 'customer'
     template_name = 'profile.html'
+    orders_paginate_by = 20
 
     def get_context_data(self, **kwargs):
-        orders = Order.objects.filter(customer=self.customer).order_by('-id')
+        orders = Order.objects.filter(customer=self.customer).order_by('-created_at', '-id')
         context = super().get_context_data(**kwargs)
-        context['orders'] = orders
+        context['orders'] = Paginator(orders, self.orders_paginate_by).get_page(self.request.GET.get('page'))
         return context
 
 
@@ -118,13 +128,13 @@ class CategoryDetailView(CustomerMixin, CartMixin, CategoryMixin, DetailView):
 
 class OrderDetailView(CustomerMixin, CartMixin, CategoryMixin, DetailView):
     model = Order
+    queryset = Order.objects.select_related('customer__user')
     template_name = 'order_view.html'
     context_object_name = 'order'
 
     def get_context_data(self, **kwargs):
-        order = Order.objects.get(pk=self.kwargs.get('pk'))
         context = super().get_context_data(**kwargs)
-        context['current_cart'] = order.cart
+        context['items'] = self.object.items.order_by('id')
         return context
 
 
@@ -136,51 +146,44 @@ class CartView(CustomerMixin, LoginRequiredMixin, CartMixin, View):
         context = {
             'cart': self.cart,
             'categories': categories,
-            'products': self.cart.products.all(),
+            'products': CartProduct.objects.get_cart_products(self.cart) if self.cart else [],
             'customer': self.customer
         }
         return render(request, 'cart.html', context)
 
 
-class AddProductToCartView(LoginRequiredMixin, CartMixin, View):
+class AddProductToCartView(LoginRequiredMixin, IdempotentMixin, CartMixin, View):
     login_url = 'login'
+    create_cart = True
 
     def get(self, request, *args, **kwargs):
         product_slug = kwargs.get('slug')
         product = Pizza.objects.get(slug=product_slug)
-        cart_product, created = CartProduct.objects.select_related('product').get_or_create(
-            customer=self.cart.customer, cart=self.cart, product=product
-        )
-        if created:
-            cart_product.final_price = product.price
-            cart_product.save()
-            self.cart.products.add(cart_product)
-        else:
-            cart_product.qty += 1
-            cart_product.save()
-        self.cart.save()
+        CartProduct.objects.add_product(self.cart, product)
         return redirect('cart')
 
 
-class DeleteFromCartView(LoginRequiredMixin, CartMixin, View):
+class DeleteFromCartView(LoginRequiredMixin, IdempotentMixin, CartMixin, View):
     login_url = 'login'
 
     def get(self, request, *args, **kwargs):
+        if not self.cart:
+            return redirect('cart')
         product_slug = kwargs.get('slug')
         product = Pizza.objects.get(slug=product_slug)
         cart_product = CartProduct.objects.get(
             customer=self.cart.customer, cart=self.cart, product=product
         )
-        self.cart.products.remove(cart_product)
         cart_product.delete()
-        self.cart.save()
         return redirect('cart')
 
 
-class ChangeQtyView(LoginRequiredMixin, CartMixin, View):
+class ChangeQtyView(LoginRequiredMixin, IdempotentMixin, CartMixin, View):
     login_url = 'login'
 
     def post(self, request, *args, **kwargs):
+        if not self.cart:
+            return redirect('cart')
         product_slug = kwargs.get('slug')
         product = Pizza.objects.get(slug=product_slug)
         cart_product = CartProduct.objects.select_related('product').get(
@@ -189,11 +192,10 @@ class ChangeQtyView(LoginRequiredMixin, CartMixin, View):
         qty = int(request.POST.get('qty'))
         cart_product.qty = qty
         cart_product.save()
-        self.cart.save()
         return redirect('cart')
 
 
-class FinishOrderView(CustomerMixin, LoginRequiredMixin, CartMixin, CreateView):
+class FinishOrderView(CustomerMixin, LoginRequiredMixin, IdempotentMixin, CartMixin, CreateView):
     form_class = OrderForm
     login_url = 'login'
     template_name = 'checkout.html'
@@ -203,16 +205,61 @@ class FinishOrderView(CustomerMixin, LoginRequiredMixin, CartMixin, CreateView):
         return dict(first_name=customer.user.first_name, last_name=customer.user.last_name, phone=customer.phone_number,
                     address=customer.address, order_date_time=timezone.now() + timedelta(hours=1, minutes=5))
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['products'] = CartProduct.objects.get_cart_products(self.cart) if self.cart else []
+        return context
+
     def get_success_url(self):
         return reverse('base')
 
     def form_valid(self, form):
-        order = form.save(commit=False)
-        order.customer = self.customer
-        order.save()
-        self.cart.in_order = True
-        self.cart.save()
-        order.cart = self.cart
-        order.save()
-        self.customer.orders.add(order)
-        return super().form_valid(form)
+        try:
+            self.object = place_order(self.customer, self.cart, form.save(commit=False))
+        except CheckoutError as e:
+            messages.info(self.request, str(e))
+            return redirect('cart')
+        return redirect(self.get_success_url())
+
+
+class KitchenView(CustomerMixin, UserPassesTestMixin, CartMixin, View):
+    login_url = 'login'
+    queue_size = 50
+
+    def test_func(self):
+        return self.request.user.is_staff
+
+    def get(self, request, *args, **kwargs):
+        next_statuses = {previous: status for status, previous in Order.STATUS_TRANSITIONS.items()}
+        labels = dict(Order.STATUS_CHOICES)
+        context = {
+            'cart': self.cart,
+            'categories': Category.objects.get_categories_for_sidebar(),
+            'customer': self.customer,
+            'queues': [
+                (labels[status], next_statuses[status], labels[next_statuses[status]],
+                 get_kitchen_queue(status).prefetch_related('items')[:self.queue_size])
+                for status in KITCHEN_STATUSES
+            ],
+        }
+        return render(request, 'kitchen.html', context)
+
+    def post(self, request, *args, **kwargs):
+        # Every checked order is sent as "id:version", the version of the status the cook has seen
+        try:
+            versions = dict(map(int, value.split(':')) for value in request.POST.getlist('orders'))
+        except ValueError:
+            versions = {}
+        if not versions:
+            messages.info(request, 'Choose the orders to move')
+            return redirect('kitchen')
+        try:
+            _, conflicts = move_orders(versions, request.POST.get('status'))
+        except KitchenError as e:
+            messages.info(request, str(e))
+            return redirect('kitchen')
+        if conflicts:
+            messages.info(request, f'Orders {", ".join(map(str, sorted(conflicts)))} were changed by somebody else, '
+                                   f'check them again')
+        return redirect('kitchen')
+